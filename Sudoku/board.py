@@ -0,0 +1,95 @@
+"""
+The model of a Sudoku board, which tracks which of the answers on the board
+conflict with each other.
+
+Rather than checking the whole board every time a cell changes, the board
+keeps track of the cells that hold each digit in every row, column and box. A
+cell is incorrect when another cell in one of its units holds the same digit,
+so changing a cell only needs to look at the cells holding the old and new
+digits in its three units.
+
+Like the solver, this does not depend on the Sublime API.
+"""
+
+
+###----------------------------------------------------------------------------
+
+
+def _units(row, col):
+    """
+    Return the indexes of the row, column and box that a cell belongs to in
+    the list of all 27 units.
+    """
+    return (row, 9 + col, 18 + (row // 3) * 3 + col // 3)
+
+
+###----------------------------------------------------------------------------
+
+
+class Board():
+    """
+    A Sudoku board; values holds the digit in each cell (0 for empty) and
+    state holds whether each cell is correct (true for empty cells), both as
+    9x9 lists of lists.
+
+    For each of the 27 units there is a list of the set of cells that hold
+    each digit, which is all that's needed to know if a cell is correct.
+    """
+    def __init__(self, puzzle):
+        self.values = [row[:] for row in puzzle]
+        self.cells = [[set() for digit in range(0, 10)] for unit in range(0, 27)]
+
+        for row in range(0, 9):
+            for col in range(0, 9):
+                value = self.values[row][col]
+                if value:
+                    for unit in _units(row, col):
+                        self.cells[unit][value].add((row, col))
+
+        self.state = [[self.check(row, col) for col in range(0, 9)] for row in range(0, 9)]
+
+    def check(self, row, col):
+        """
+        Determine if the given cell is correct, based on the digits in its
+        units.
+        """
+        value = self.values[row][col]
+        if not value:
+            return True
+
+        return all(len(self.cells[unit][value]) == 1 for unit in _units(row, col))
+
+    def set(self, row, col, value):
+        """
+        Set the digit in a cell (0 to clear it), returning the set of (row,
+        col) cells whose correctness changed as a result; this can include the
+        cell itself.
+        """
+        old = self.values[row][col]
+        if old == value:
+            return set()
+
+        units = _units(row, col)
+        affected = {(row, col)}
+
+        if old:
+            for unit in units:
+                holders = self.cells[unit][old]
+                holders.discard((row, col))
+                affected.update(holders)
+
+        self.values[row][col] = value
+        if value:
+            for unit in units:
+                holders = self.cells[unit][value]
+                holders.add((row, col))
+                affected.update(holders)
+
+        changed = set()
+        for r, c in affected:
+            correct = self.check(r, c)
+            if correct != self.state[r][c]:
+                self.state[r][c] = correct
+                changed.add((r, c))
+
+        return changed
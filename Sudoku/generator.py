@@ -0,0 +1,176 @@
+"""
+Generate Sudoku puzzles that have a unique solution, graded by how hard they
+are to solve.
+
+A puzzle is graded by the techniques the solver needs to solve it; a puzzle
+that falls to naked singles alone is easy, one that also needs hidden singles
+is medium and one that needs guessing is hard.
+
+Like the solver, this does not depend on the Sublime API.
+"""
+import random
+from collections import deque
+from threading import Thread, Lock, Condition
+
+from .solver import SolverStats, find_solutions
+
+
+###----------------------------------------------------------------------------
+
+
+# The difficulties that puzzles are graded into, easiest first.
+DIFFICULTIES = ["easy", "medium", "hard"]
+
+# How many times to try to generate a puzzle of a particular difficulty before
+# settling for the closest one that was found.
+GENERATE_ATTEMPTS = 20
+
+
+###----------------------------------------------------------------------------
+
+
+def grade(puzzle):
+    """
+    Grade a puzzle by the techniques needed to solve it, returning one of
+    DIFFICULTIES.
+    """
+    stats = SolverStats()
+    find_solutions(puzzle, 1, stats)
+
+    if stats.guesses:
+        return "hard"
+
+    return "medium" if stats.hidden_singles else "easy"
+
+
+def random_solution(rng=random):
+    """
+    Generate a random solved board; the three boxes on the diagonal don't
+    affect each other, so they're filled in at random and the solver fills in
+    the rest.
+    """
+    board = [[0] * 9 for row in range(0, 9)]
+    for box in range(0, 3):
+        digits = rng.sample(range(1, 10), 9)
+        for i, digit in enumerate(digits):
+            board[box * 3 + i // 3][box * 3 + i % 3] = digit
+
+    return find_solutions(board, 1)[0]
+
+
+def generate(difficulty="medium", rng=random):
+    """
+    Generate a puzzle with a unique solution at the given difficulty,
+    returning a tuple of the puzzle and its solution as 9x9 lists of lists.
+
+    Cells are removed from a random solution in symmetric pairs for as long
+    as the solution stays unique and the puzzle doesn't get harder than asked
+    for. This is retried until the puzzle ends up as hard as asked for; if
+    that doesn't happen in GENERATE_ATTEMPTS tries, the hardest puzzle found
+    is used instead.
+    """
+    target = DIFFICULTIES.index(difficulty)
+    best = None
+
+    for attempt in range(GENERATE_ATTEMPTS):
+        solution = random_solution(rng)
+        puzzle = [row[:] for row in solution]
+
+        cells = list(range(0, 41))
+        rng.shuffle(cells)
+        for i in cells:
+            pair = {(i // 9, i % 9), ((80 - i) // 9, (80 - i) % 9)}
+            removed = [(r, c, puzzle[r][c]) for r, c in pair]
+            for r, c, value in removed:
+                puzzle[r][c] = 0
+
+            if (len(find_solutions(puzzle, 2)) != 1 or
+                    DIFFICULTIES.index(grade(puzzle)) > target):
+                for r, c, value in removed:
+                    puzzle[r][c] = value
+
+        level = DIFFICULTIES.index(grade(puzzle))
+        if level == target:
+            return (puzzle, solution)
+
+        if best is None or level > best[0]:
+            best = (level, puzzle, solution)
+
+    return best[1:]
+
+
+###----------------------------------------------------------------------------
+
+
+class PuzzlePool():
+    """
+    Keep a few puzzles of each difficulty generated ahead of time, so that
+    starting a new game doesn't have to wait for one to be generated.
+
+    Puzzles are generated by a background thread, which tops up the queue of
+    each difficulty whenever a puzzle is taken from it.
+    """
+    def __init__(self, size=2):
+        self.size = size
+        self.lock = Lock()
+        self.wanted = Condition(self.lock)
+        self.queues = {difficulty: deque() for difficulty in DIFFICULTIES}
+        self.running = False
+        self.thread = None
+
+    def start(self):
+        """
+        Start generating puzzles in the background.
+        """
+        with self.lock:
+            if self.running:
+                return
+
+            self.running = True
+            self.thread = Thread(target=self.run, daemon=True)
+            self.thread.start()
+
+    def stop(self):
+        """
+        Stop generating puzzles; any puzzle currently being generated is
+        thrown away.
+        """
+        with self.lock:
+            self.running = False
+            self.wanted.notify_all()
+
+    def take(self, difficulty):
+        """
+        Return a (puzzle, solution) tuple of the given difficulty, generating
+        one on the spot if there are none ready.
+        """
+        with self.lock:
+            queue = self.queues[difficulty]
+            puzzle = queue.popleft() if queue else None
+            self.wanted.notify_all()
+
+        return puzzle or generate(difficulty)
+
+    def needed(self):
+        """
+        Return the difficulty that most needs a puzzle generated, or None if
+        all of the queues are full; the caller must be holding the lock.
+        """
+        difficulty = min(DIFFICULTIES, key=lambda d: len(self.queues[d]))
+        return difficulty if len(self.queues[difficulty]) < self.size else None
+
+    def run(self):
+        while True:
+            with self.lock:
+                while self.running and self.needed() is None:
+                    self.wanted.wait()
+
+                if not self.running:
+                    return
+
+                difficulty = self.needed()
+
+            puzzle = generate(difficulty)
+
+            with self.lock:
+                self.queues[difficulty].append(puzzle)
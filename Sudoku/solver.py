@@ -0,0 +1,267 @@
+"""
+A Sudoku solver based on constraint propagation over bitmasks.
+
+The candidates of each cell are tracked as a 9 bit mask (bit 0 is the digit
+1, and so on), built from masks of the digits placed in each row, column and
+box and then kept up to date as digits are placed. Naked and hidden singles
+are filled in until neither applies, and then the empty cell with the fewest
+candidates is guessed at, backtracking on failure.
+
+This module does not depend on the Sublime API, so that it can be used (and
+benchmarked) outside of Sublime.
+"""
+
+
+###----------------------------------------------------------------------------
+
+
+# A mask with a bit set for all of the digits 1-9.
+ALL_DIGITS = 0x1FF
+
+# The row, column and box that each cell belongs to.
+_ROW = [i // 9 for i in range(81)]
+_COL = [i % 9 for i in range(81)]
+_BOX = [(i // 27) * 3 + (i % 9) // 3 for i in range(81)]
+
+# The cells in each of the 27 units; rows, then columns, then boxes.
+_UNITS = ([[r * 9 + c for c in range(9)] for r in range(9)] +
+          [[r * 9 + c for r in range(9)] for c in range(9)] +
+          [[i for i in range(81) if _BOX[i] == b] for b in range(9)])
+
+# The cells that share a row, column or box with each cell.
+_PEERS = [sorted(set(j for unit in _UNITS if i in unit for j in unit) - {i})
+          for i in range(81)]
+
+# The number of bits set in every possible candidate mask.
+_POPCOUNT = [bin(mask).count("1") for mask in range(ALL_DIGITS + 1)]
+
+# The digit for a mask with a single bit set.
+_DIGIT = {1 << d: d + 1 for d in range(9)}
+
+
+###----------------------------------------------------------------------------
+
+
+class SolverStats():
+    """
+    What it took to solve a puzzle; the number of naked and hidden singles
+    that were placed and the number of guesses that had to be made. These are
+    summed over all branches that were tried.
+    """
+    def __init__(self):
+        self.naked_singles = 0
+        self.hidden_singles = 0
+        self.guesses = 0
+
+
+class _Board():
+    """
+    The state of a board while it is being solved; cells holds the digit in
+    each cell (0 for empty) and cands holds the mask of the candidates that
+    are left for each empty cell.
+    """
+    __slots__ = ("cells", "cands")
+
+    def __init__(self, cells, cands):
+        self.cells = cells
+        self.cands = cands
+
+    def copy(self):
+        return _Board(self.cells[:], self.cands[:])
+
+    def place(self, i, bit, singles):
+        """
+        Place a digit into a cell and remove it from the candidates of the
+        cells that share a unit with it. Cells that are left with a single
+        candidate are added to singles; the return value is False if a cell
+        is left with no candidates at all.
+        """
+        cells = self.cells
+        cands = self.cands
+        cells[i] = _DIGIT[bit]
+        cands[i] = 0
+        for p in _PEERS[i]:
+            mask = cands[p]
+            if mask & bit:
+                mask ^= bit
+                cands[p] = mask
+                if not mask & (mask - 1):
+                    if not mask:
+                        return False
+                    singles.append(p)
+
+        return True
+
+
+def _make_board(puzzle):
+    """
+    Build a board from a 9x9 list of lists, returning None if the digits that
+    are already placed conflict with each other.
+    """
+    rows = [0] * 9
+    cols = [0] * 9
+    boxes = [0] * 9
+    cells = [0] * 81
+    for i in range(81):
+        value = puzzle[_ROW[i]][_COL[i]]
+        if value:
+            bit = 1 << (value - 1)
+            if (rows[_ROW[i]] | cols[_COL[i]] | boxes[_BOX[i]]) & bit:
+                return None
+
+            cells[i] = value
+            rows[_ROW[i]] |= bit
+            cols[_COL[i]] |= bit
+            boxes[_BOX[i]] |= bit
+
+    cands = [0 if cells[i] else
+             ALL_DIGITS & ~(rows[_ROW[i]] | cols[_COL[i]] | boxes[_BOX[i]])
+             for i in range(81)]
+    if not all(cells[i] or cands[i] for i in range(81)):
+        return None
+
+    return _Board(cells, cands)
+
+
+def _propagate(board, singles, stats):
+    """
+    Fill in naked and hidden singles until there are none left, starting with
+    the given cells that are known to have a single candidate. The return
+    value is None if the board turned out to be unsolvable, or otherwise the
+    empty cell with the fewest candidates, or -1 if the board is full.
+    """
+    cells = board.cells
+    cands = board.cands
+    while True:
+        # Naked singles; cells that have only one candidate.
+        while singles:
+            i = singles.pop()
+            if cells[i]:
+                continue
+
+            stats.naked_singles += 1
+            if not board.place(i, cands[i], singles):
+                return None
+
+        # Hidden singles; digits that fit in only one cell of a unit. Only
+        # one is placed at a time, since it may create naked singles.
+        for unit in _UNITS:
+            once = twice = placed = 0
+            for i in unit:
+                if cells[i]:
+                    placed |= 1 << (cells[i] - 1)
+                else:
+                    mask = cands[i]
+                    twice |= once & mask
+                    once |= mask
+
+            if (once | placed) != ALL_DIGITS:
+                return None
+
+            hidden = once & ~twice
+            if hidden:
+                bit = hidden & -hidden
+                for i in unit:
+                    if cands[i] & bit:
+                        break
+
+                stats.hidden_singles += 1
+                if not board.place(i, bit, singles):
+                    return None
+                break
+
+        if singles or hidden:
+            continue
+
+        # Nothing left to deduce, so find the best cell to guess at.
+        best = -1
+        best_count = 10
+        for i in range(81):
+            if not cells[i]:
+                count = _POPCOUNT[cands[i]]
+                if count < best_count:
+                    best = i
+                    best_count = count
+                    if count == 2:
+                        break
+
+        return best
+
+
+def _search(board, singles, limit, solutions, stats):
+    """
+    Solve the board by propagation and guessing, adding every solution found
+    to solutions until there are limit of them.
+    """
+    best = _propagate(board, singles, stats)
+    if best is None:
+        return
+
+    if best == -1:
+        solutions.append(board.cells)
+        return
+
+    mask = board.cands[best]
+    while mask and len(solutions) < limit:
+        bit = mask & -mask
+        mask ^= bit
+
+        stats.guesses += 1
+        branch = board.copy()
+        singles = []
+        if branch.place(best, bit, singles):
+            _search(branch, singles, limit, solutions, stats)
+
+
+def _grid(cells):
+    return [cells[r * 9:r * 9 + 9] for r in range(9)]
+
+
+###----------------------------------------------------------------------------
+
+
+def solve(puzzle, stats=None):
+    """
+    Solve a puzzle given as a 9x9 list of lists of digits, where 0 is an empty
+    cell. The return value is the solution in the same form, or None if the
+    puzzle has no solution. If the puzzle has more than one solution, the
+    first one found is returned.
+    """
+    solutions = find_solutions(puzzle, 1, stats)
+    return solutions[0] if solutions else None
+
+
+def find_solutions(puzzle, limit=2, stats=None):
+    """
+    Find up to limit solutions to a puzzle given as a 9x9 list of lists,
+    stopping as soon as that many have been found; counting to 2 is enough to
+    tell whether a puzzle has a unique solution.
+    """
+    board = _make_board(puzzle)
+    if board is None:
+        return []
+
+    solutions = []
+    singles = [i for i in range(81) if _POPCOUNT[board.cands[i]] == 1]
+    _search(board, singles, limit, solutions, stats or SolverStats())
+    return [_grid(cells) for cells in solutions]
+
+
+def count_solutions(puzzle, limit=2):
+    """
+    Count the solutions of a puzzle, stopping at limit.
+    """
+    return len(find_solutions(puzzle, limit))
+
+
+def parse_puzzle(text):
+    """
+    Parse a puzzle from the common single line format of 81 characters, where
+    digits are placed values and '.' or '0' are empty cells, into a 9x9 list
+    of lists.
+    """
+    digits = [int(c) if c in "123456789" else 0 for c in text if c in "0123456789."]
+    if len(digits) != 81:
+        raise ValueError("A puzzle needs 81 cells, not %d" % len(digits))
+
+    return _grid(digits)
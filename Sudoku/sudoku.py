@@ -1,8 +1,11 @@
 import sublime
 import sublime_plugin
 
-from collections import Counter
-from itertools import chain
+import time
+
+from .solver import solve
+from .board import Board
+from .generator import PuzzlePool
 
 
 ###----------------------------------------------------------------------------
@@ -14,36 +17,6 @@ _grid_b = '\\---^---^---/'
 _grid_h = '>---+---+---<'
 _grid_v = '|   |   |   |'
 
-# Our sample puzzle
-_puzzle = [
-    [0, 0, 0,    0, 0, 4,    1, 8, 7],
-    [8, 0, 0,    1, 0, 0,    6, 4, 0],
-    [0, 1, 0,    0, 0, 0,    0, 2, 0],
-
-    [9, 0, 0,    0, 1, 3,    0, 0, 4],
-    [0, 5, 1,    0, 2, 0,    8, 0, 6],
-    [3, 6, 7,    0, 0, 5,    2, 0, 0],
-
-    [5, 9, 6,    0, 0, 0,    0, 0, 0],
-    [0, 4, 0,    5, 9, 0,    0, 7, 0],
-    [0, 7, 3,    4, 8, 1,    0, 0, 5]
-]
-
-# The state of answers in the puzzle (true is correct, false is wrong)
-_state = [
-    [True, True, True,    True, True, True,    True, True, True],
-    [True, True, True,    True, True, True,    True, True, True],
-    [True, True, True,    True, True, True,    True, True, True],
-
-    [True, True, True,    True, True, True,    True, True, True],
-    [True, True, True,    True, True, True,    True, True, True],
-    [True, True, True,    True, True, True,    True, True, True],
-
-    [True, True, True,    True, True, True,    True, True, True],
-    [True, True, True,    True, True, True,    True, True, True],
-    [True, True, True,    True, True, True,    True, True, True],
-]
-
 # The hint values set up for this field
 _hints = [
     [ [], [], [],    [], [], [],    [], [], [] ],
@@ -60,6 +33,32 @@ _hints = [
 ]
 
 
+# The pool of pre-generated puzzles that new games are taken from
+_puzzle_pool = None
+
+
+###----------------------------------------------------------------------------
+
+
+def plugin_loaded():
+    """
+    Start generating puzzles in the background, so that they're ready to go
+    when a new game is started.
+    """
+    global _puzzle_pool
+
+    _puzzle_pool = PuzzlePool()
+    _puzzle_pool.start()
+
+
+def plugin_unloaded():
+    global _puzzle_pool
+
+    if _puzzle_pool is not None:
+        _puzzle_pool.stop()
+        _puzzle_pool = None
+
+
 ###----------------------------------------------------------------------------
 
 
@@ -104,48 +103,6 @@ def _make_grid():
     return g
 
 
-def _validate_board(data, state):
-    """
-    Given a puzzle and state, check to see which cell positions appear to be
-    valid or invalid and update the state as appropriate so that all cells with
-    an answer are properly flagged.
-    """
-    # Collect the values in each row that appear more than once.
-    i_rows = []
-    for row in range(0, 9):
-        i_rows.append([k for k,v in Counter(data[row]).items() if k != 0 and v > 1])
-
-    # Collect the values in each column that appear more than once.
-    i_cols = []
-    for col in range(0, 9):
-        raw = []
-        for row in range(0, 9):
-            raw.append(data[row][col])
-
-        i_cols.append([k for k,v in Counter(raw).items() if k != 0 and v > 1])
-
-    # Collect the values in each grid that appear more than once.
-    raw = [[] for r in range(0, 9)]
-    for row in range(0, 9):
-        for col in range(0, 9):
-            grid = (col // 3) + ((row // 3) * 3)
-
-            raw[grid].append(data[row][col])
-
-    i_grids = [[k for k,v in Counter(raw[r]).items() if k != 0 and v > 1] for r in range(0, 9) ]
-
-    # Scan every cell in the puzzle and mark it based on whether it's value
-    # appears as a duplicate in any of the three lists.
-    for row in range(0, 9):
-        for col in range(0, 9):
-            v = data[row][col]
-            if v:
-                grid = (col // 3) + ((row // 3) * 3)
-
-
-                state[row][col] = v not in chain(i_rows[row], i_cols[col], i_grids[grid])
-
-
 ###----------------------------------------------------------------------------
 
 
@@ -153,8 +110,10 @@ class SudokuNewGameCommand(sublime_plugin.ApplicationCommand):
     """
     Start a new Sudoku game; this spawns a new window for the game and creates
     an appropriate view inside of it to represent the game.
+
+    The difficulty is one of "easy", "medium" or "hard".
     """
-    def run(self):
+    def run(self, difficulty="medium"):
         sublime.run_command("new_window")
         window = sublime.active_window()
 
@@ -169,7 +128,7 @@ class SudokuNewGameCommand(sublime_plugin.ApplicationCommand):
         view.set_name("Sublime Sudoku")
         view.set_scratch(True)
 
-        view.run_command("sudoku", {"action": "new_game"})
+        view.run_command("sudoku", {"action": "new_game", "difficulty": difficulty})
 
         # Finalize it now; from this point forward we need to adjust the read
         # only state in order to modify the view.
@@ -182,16 +141,16 @@ class SudokuBase():
     This is the base class for our Sudoku game commands, and encapsulates all
     of the boilerplate logic needed by those commands.
     """
+    # The regions of the top left corners of the cells and the table of the
+    # frame, content and answer regions of each cell; see layout().
+    cells = None
+    geometry = None
+
     def run(self, edit, action, **kwargs):
         # If we don't know where our game cells are yet, then try to capture
-        # them now, and save them if we found them.
-        if not hasattr(self, "cells"):
-            cells = self.view.find_by_selector("meta.cell.corner")
-            if cells:
-                self.cells = cells
-                # TODO: Calculculate the width and height based on the offsets
-                self.cell_width = 5
-                self.cell_height = 5
+        # them now.
+        if self.cells is None:
+            self.layout()
 
         # Save the edit object from this invocation for later method use just
         # for code clarity reasons; this can't be used after the command ends.
@@ -207,28 +166,57 @@ class SudokuBase():
     def is_enabled(self, **kwargs):
         return self.view.match_selector(0, "text.plain.sudoku")
 
-    def span(self, pos, offset, width):
+    def layout(self):
         """
-        Given a position tuple of (row, col) and an offset tuple, return back a
-        region that starts at the offset position and has the given width.
+        Capture the layout of the grid in the view, if there is one. The size
+        of a cell is worked out from the distance between the corners of the
+        first cells, since neighboring cells share their borders, and then the
+        frame, content and answer regions of every cell are calculated once
+        and kept in a table.
         """
-        pos = self.view.text_point(*pos)
-        pos = tuple(map(sum, zip(self.view.rowcol(pos), offset)))
-        pos = self.view.text_point(*pos)
+        cells = self.view.find_by_selector("meta.cell.corner")
+        if len(cells) != 81:
+            return
 
-        return sublime.Region(pos, pos + width)
+        corners = [self.view.rowcol(region.begin()) for region in cells]
+        self.cell_width = corners[1][1] - corners[0][1] + 1
+        self.cell_height = corners[9][0] - corners[0][0] + 1
+
+        lines = {}
+        for row, col in corners:
+            for r in range(row, row + self.cell_height):
+                if r not in lines:
+                    lines[r] = self.view.text_point(r, 0)
+
+        def span(root, offset, width):
+            pos = lines[root[0] + offset[0]] + root[1] + offset[1]
+            return sublime.Region(pos, pos + width)
+
+        w, h = self.cell_width, self.cell_height
+        self.geometry = [(
+            [span(root, (0, 1), w - 2)] +
+            [span(root, (r, 0), 1) for r in range(1, h - 1)] +
+            [span(root, (r, w - 1), 1) for r in range(1, h - 1)] +
+            [span(root, (h - 1, 1), w - 2)],
+            [span(root, (r, 1), w - 2) for r in range(1, h - 1)],
+            span(root, (h // 2, w // 2), 1)
+            ) for root in corners]
+        self.cells = cells
+
+    def invalidate_layout(self):
+        """
+        Forget the layout of the grid; it's captured again the next time this
+        command runs.
+        """
+        self.cells = None
+        self.geometry = None
 
     def frame(self, row, col):
         """
         Given a 0 based row and column, return back a list of regions that
         represent the frame surrounding that cell.
         """
-        root = self.view.rowcol(self.cells[(row * 9) + col].begin())
-        return (
-            [self.span(root, (0, 1), self.cell_width - 2)] +
-            [self.span(root, (r, 0), 1) for r in range(1, self.cell_height - 1)] +
-            [self.span(root, (r, self.cell_width - 1), 1) for r in range(1, self.cell_height - 1)] +
-            [self.span(root, (self.cell_height - 1, 1), self.cell_width - 2)])
+        return self.geometry[(row * 9) + col][0]
 
     def content(self, row, col):
         """
@@ -236,8 +224,14 @@ class SudokuBase():
         represent the inner portion of that cell. This will be one region for
         each row in the cell.
         """
-        root = self.view.rowcol(self.cells[(row * 9) + col].begin())
-        return [self.span(root, (r, 1), self.cell_width - 2) for r in range(1, self.cell_height - 1)]
+        return self.geometry[(row * 9) + col][1]
+
+    def answer(self, row, col):
+        """
+        Given a 0 based row and column, return back the region that the answer
+        in that cell is displayed in.
+        """
+        return self.geometry[(row * 9) + col][2]
 
     def cell(self, region):
         """
@@ -250,12 +244,21 @@ class SudokuBase():
     def render(self, action, **kwargs):
         """
         Invoke the sudoku render command with the given action and arguments.
+
+        When the sudoku_render_timing setting is turned on, the time each
+        render takes is logged to the console.
         """
         kwargs["action"] = action
+        started = time.perf_counter()
+
         self.view.set_read_only(False)
         self.view.run_command("sudoku_render", kwargs)
         self.view.set_read_only(True)
 
+        if self.get("render_timing", False):
+            print("Sudoku: render '%s' took %.2fms" % (
+                action, (time.perf_counter() - started) * 1000))
+
     def persist(self, name, value):
         """
         Persist into the settings of the view the value provided.
@@ -275,9 +278,22 @@ class SudokuCommand(SudokuBase, sublime_plugin.TextCommand):
     This command acts as the entry point into the game logic; the action given
     is used to drive the game and the actions taken by the user.
     """
-    def _new_game(self):
-        self.persist("puzzle", _puzzle)
-        self.persist("state", _state)
+    def board(self):
+        """
+        Get the model of the board for this game, creating it from the
+        persisted puzzle if needed.
+        """
+        if not hasattr(self, "_board"):
+            self._board = Board(self.get("puzzle"))
+
+        return self._board
+
+    def _new_game(self, difficulty="medium"):
+        puzzle = _puzzle_pool.take(difficulty)[0]
+        self._board = Board(puzzle)
+
+        self.persist("puzzle", puzzle)
+        self.persist("state", self._board.state)
         self.persist("hints", _hints)
         self.persist("current_pos", [4, 4])
         self.persist("hinting", False)
@@ -297,11 +313,21 @@ class SudokuCommand(SudokuBase, sublime_plugin.TextCommand):
             self.render("grid")
         self.render("puzzle", puzzle=puzzle, state=state, hints=hints)
         self.render("hilight_cell", row=pos[0], col=pos[1], hinting=hinting)
-        self.render("hilight_values", value=value, puzzle=puzzle)
+        self.render("hilight_values", value=value)
+
+
+    def _solve(self):
+        solution = solve(self.get("puzzle"))
+        if solution is None:
+            return sublime.message_dialog(
+                "This puzzle can't be solved; check for incorrect answers")
 
+        self._board = Board(solution)
+        self.persist("puzzle", solution)
+        self.persist("state", self._board.state)
+        self._redraw(complete=False)
 
     def _move(self, row, col):
-        puzzle = self.get("puzzle")
         current_pos = self.get("current_pos", [0, 0])
         new_pos = [
             max(0, min(current_pos[0] + row, 8)),
@@ -312,8 +338,8 @@ class SudokuCommand(SudokuBase, sublime_plugin.TextCommand):
             self.persist("current_pos", new_pos)
             hinting = self.get("hinting", False)
             self.render("hilight_cell", row=new_pos[0], col=new_pos[1], hinting=hinting)
-            value = puzzle[new_pos[0]][new_pos[1]]
-            self.render("hilight_values", value=value, puzzle=puzzle)
+            value = self.board().values[new_pos[0]][new_pos[1]]
+            self.render("hilight_values", value=value)
 
     def _toggle_hinting(self):
         hinting = not self.get("hinting", False)
@@ -326,27 +352,28 @@ class SudokuCommand(SudokuBase, sublime_plugin.TextCommand):
         if character == " ":
             return self._toggle_hinting()
 
-        # TODO: Render only the current cell, not all cells
         if character.isdigit():
             new_value = int(character)
 
             pos = self.get("current_pos")
-            puzzle_data = self.get("puzzle")
-            puzzle_state = self.get("state")
+            board = self.board()
 
-            # Set in the value, then validate the new board state/
-            puzzle_data[pos[0]][pos[1]] = new_value
-            _validate_board(puzzle_data, puzzle_state)
+            # Set in the value; the board tells us which other cells need to
+            # be rendered because their correctness changed.
+            dirty = board.set(pos[0], pos[1], new_value)
+            dirty.add(tuple(pos))
 
-            self.persist("puzzle", puzzle_data)
-            self.persist("state", puzzle_state)
-            self._redraw(complete=False)
+            self.persist("puzzle", board.values)
+            self.persist("state", board.state)
+            self.render("cells", cells=sorted(dirty), puzzle=board.values,
+                        state=board.state, hints=self.get("hints"))
+            self.render("hilight_cell", row=pos[0], col=pos[1], hinting=False)
+            self.render("hilight_values", value=new_value)
 
     def _hint_input(self, character):
         if character == " ":
             return self._toggle_hinting()
 
-        # TODO: Render only the current cell, not all cells
         if character.isdigit():
             user_hint = int(character)
 
@@ -362,7 +389,9 @@ class SudokuCommand(SudokuBase, sublime_plugin.TextCommand):
                     hint_list.append(user_hint)
 
                 self.persist("hints", puzzle_hints)
-                self._redraw(complete=False)
+                self.render("cells", cells=[pos], puzzle=puzzle_data,
+                            state=self.get("state"), hints=puzzle_hints)
+                self.render("hilight_cell", row=pos[0], col=pos[1], hinting=True)
 
 
 
@@ -371,7 +400,52 @@ class SudokuRenderCommand(SudokuBase, sublime_plugin.TextCommand):
     Performs all "rendering" in the game view for us, based on the arguments
     provided. This allows a single command to cache the list of regions that
     know where the cells in the grid are situated.
+
+    It also keeps an index of which cells hold each answer, split into correct
+    and incorrect answers, which is updated as cells are rendered so that
+    matching answers can be highlighted without searching the view.
     """
+    # Maps each digit to a tuple of the set of (row, col) cells that hold it
+    # as an incorrect answer and the set that hold it as a correct one; see
+    # index_answer().
+    answers = None
+    answer_cells = None
+
+    def index_answer(self, row, col, value, correct):
+        """
+        Record the answer that is now displayed in the given cell (0 for
+        none) in the answer index.
+        """
+        cell = (row, col)
+        old = self.answer_cells.pop(cell, None)
+        if old is not None:
+            self.answers[old[0]][old[1]].discard(cell)
+
+        if value:
+            self.answer_cells[cell] = (value, correct)
+            self.answers[value][correct].add(cell)
+
+    def reset_answers(self):
+        self.answers = {value: (set(), set()) for value in range(1, 10)}
+        self.answer_cells = {}
+
+    def scan_answers(self):
+        """
+        Build the answer index from the answers that are displayed in the
+        view; this is only needed if the board was rendered before this
+        command was created, such as when the plugin is reloaded.
+        """
+        self.reset_answers()
+
+        v = self.view
+        for row in range(0, 9):
+            for col in range(0, 9):
+                region = self.answer(row, col)
+                text = v.substr(region)
+                if text.isdigit() and v.match_selector(region.a, "answer"):
+                    correct = v.match_selector(region.a, "meta.answer.correct")
+                    self.index_answer(row, col, int(text), correct)
+
     def cell_fill(self, row, col, puzzle, state, hints):
         value = puzzle[row][col]
         correct = state[row][col]
@@ -394,28 +468,68 @@ class SudokuRenderCommand(SudokuBase, sublime_plugin.TextCommand):
     def _grid(self):
         grid_region = sublime.Region(0, len(self.view))
         self.view.replace(self.edit, grid_region , _make_grid())
+        self.invalidate_layout()
+        self.reset_answers()
 
     def _puzzle(self, puzzle, state, hints):
+        self.reset_answers()
         for row in range(0, 9):
             for col in range(0, 9):
+                self.index_answer(row, col, puzzle[row][col], state[row][col])
                 fill = self.cell_fill(row, col, puzzle, state, hints)
                 spans = self.content(row, col)
                 for span, text in zip(spans, fill):
                     self.view.replace(self.edit, span, text)
 
+    def _cells(self, cells, puzzle, state, hints):
+        """
+        Render only the given list of (row, col) cells. Replacing a cell never
+        changes the length of the text, so spans on the same line that are
+        close together are joined into a single edit, keeping the text that
+        separates them.
+        """
+        if self.answers is None:
+            self.scan_answers()
+
+        lines = {}
+        for row, col in cells:
+            self.index_answer(row, col, puzzle[row][col], state[row][col])
+            fill = self.cell_fill(row, col, puzzle, state, hints)
+            for line, (span, text) in enumerate(zip(self.content(row, col), fill)):
+                lines.setdefault((row, line), []).append((span, text))
+
+        for spans in lines.values():
+            spans.sort(key=lambda item: item[0].a)
+
+            region, text = spans[0]
+            for span, fill in spans[1:]:
+                if span.a - region.b > 3:
+                    self.view.replace(self.edit, region, text)
+                    region, text = span, fill
+                    continue
+
+                gap = self.view.substr(sublime.Region(region.b, span.a))
+                region = sublime.Region(region.a, span.b)
+                text += gap + fill
+
+            self.view.replace(self.edit, region, text)
+
     def _hilight_cell(self, row, col, hinting=False):
         scope = "sudoku.cursor.hinting" if hinting else "sudoku.cursor.editing"
         self.view.add_regions("sudoku_highlight", self.frame(row, col), scope,
                               flags=sublime.DRAW_NO_OUTLINE|sublime.PERSISTENT)
 
-    def _hilight_values(self, value, puzzle):
-        n = str(value)
+    def _hilight_values(self, value):
+        if self.answers is None:
+            self.scan_answers()
+
         v = self.view
 
-        # Find all regions that are right or wrong that match the value that we
-        # were given.
-        right = [r for r in v.find_by_selector("meta.answer.correct answer") if v.substr(r) == n]
-        wrong = [r for r in v.find_by_selector("meta.answer.incorrect answer") if v.substr(r) == n]
+        # Look up the cells that are right or wrong that hold the value that
+        # we were given.
+        wrong, right = self.answers.get(value, (set(), set()))
+        right = [self.answer(row, col) for row, col in right]
+        wrong = [self.answer(row, col) for row, col in wrong]
         v.add_regions("sudoku_hilight_right", right, "sudoku.correct.selected",
                       flags=sublime.DRAW_NO_OUTLINE|sublime.PERSISTENT)
         v.add_regions("sudoku_hilight_wrong", wrong, "sudoku.incorrect.selected",
@@ -0,0 +1,93 @@
+"""
+Benchmark the Sudoku solver over a corpus of puzzles, reporting the time taken
+for each puzzle and the overall number of puzzles solved per second.
+
+The corpus is a text file with one puzzle per line in the common 81 character
+format; blank lines and lines starting with '#' are ignored. The default is
+hard_puzzles.txt next to this script, but any of the standard collections
+(such as top95 or top1465) can be given instead.
+
+Usage: python bench_solver.py [--corpus FILE] [--repeat N] [--count]
+"""
+import os
+import sys
+import time
+import argparse
+
+
+###----------------------------------------------------------------------------
+
+
+_tools = os.path.dirname(os.path.abspath(__file__))
+_root = os.path.dirname(os.path.dirname(_tools))
+
+
+###----------------------------------------------------------------------------
+
+
+def load_corpus(path):
+    """
+    Load the puzzles from a corpus file, returning a list of (name, puzzle)
+    tuples; puzzles are named by the comment before them, if any.
+    """
+    from Sudoku.solver import parse_puzzle
+
+    puzzles = []
+    name = None
+    with open(path, "r", encoding="utf-8") as handle:
+        for line in handle:
+            line = line.strip()
+            if line.startswith("#"):
+                name = line[1:].strip()
+            elif line:
+                puzzles.append((name or "#%d" % (len(puzzles) + 1), parse_puzzle(line)))
+                name = None
+
+    return puzzles
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the Sudoku solver")
+    parser.add_argument("--corpus", default=os.path.join(_tools, "hard_puzzles.txt"),
+                        help="The file of puzzles to solve")
+    parser.add_argument("--repeat", type=int, default=5,
+                        help="How many times to solve each puzzle; the best time is used")
+    parser.add_argument("--count", action="store_true",
+                        help="Also prove that each solution is unique")
+    args = parser.parse_args()
+
+    sys.path.insert(0, _root)
+    from Sudoku.solver import SolverStats, find_solutions
+
+    limit = 2 if args.count else 1
+    puzzles = load_corpus(args.corpus)
+    total = 0.0
+    failures = 0
+
+    print("%-30s %10s %8s %8s %8s" % ("Puzzle", "Time", "Guesses", "Naked", "Hidden"))
+    for name, puzzle in puzzles:
+        best = None
+        for _ in range(args.repeat):
+            stats = SolverStats()
+            started = time.perf_counter()
+            solutions = find_solutions(puzzle, limit, stats)
+            elapsed = time.perf_counter() - started
+            best = elapsed if best is None else min(best, elapsed)
+
+        if len(solutions) != 1:
+            failures += 1
+
+        total += best
+        print("%-30s %8.2fms %8d %8d %8d%s" % (name[:30], best * 1000,
+            stats.guesses, stats.naked_singles, stats.hidden_singles,
+            "" if len(solutions) == 1 else "  (%d solutions)" % len(solutions)))
+
+    print()
+    print("Puzzles:      %d (%d without a unique solution)" % (len(puzzles), failures)
+          if args.count else "Puzzles:      %d (%d unsolved)" % (len(puzzles), failures))
+    print("Total time:   %.2fms" % (total * 1000))
+    print("Throughput:   %.1f puzzles/s" % (len(puzzles) / total))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,235 @@
+import time
+from threading import Lock
+
+
+###----------------------------------------------------------------------------
+
+
+# The upper bounds (in milliseconds) of the buckets in latency histograms; a
+# final bucket catches everything slower than the last bound.
+LATENCY_BUCKETS = (10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+
+###----------------------------------------------------------------------------
+
+
+class Histogram():
+    """
+    A simple fixed bucket histogram of latencies in milliseconds, which also
+    tracks the count, total and maximum of the values added.
+    """
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, value):
+        idx = next((i for i, bound in enumerate(self.buckets) if value <= bound),
+                   len(self.buckets))
+        self.counts[idx] += 1
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+    def percentile(self, percent):
+        """
+        Return an estimate of the given percentile; this is the upper bound of
+        the bucket it falls in (or the maximum for the final bucket).
+        """
+        if not self.count:
+            return 0.0
+
+        target = self.count * percent / 100.0
+        seen = 0
+        for idx, count in enumerate(self.counts):
+            seen += count
+            if seen >= target:
+                return min(self.buckets[idx], self.max) if idx < len(self.buckets) else self.max
+
+        return self.max
+
+    def to_dict(self):
+        return {
+            "count": self.count,
+            "mean_ms": round(self.mean(), 2),
+            "p50_ms": self.percentile(50),
+            "p95_ms": self.percentile(95),
+            "p99_ms": self.percentile(99),
+            "max_ms": round(self.max, 2),
+            "buckets": dict(zip([str(b) for b in self.buckets] + ["inf"], self.counts))
+        }
+
+
+###----------------------------------------------------------------------------
+
+
+class NetworkMetrics():
+    """
+    Collects statistics on how the network layer is behaving; this is updated
+    from both the main thread and the network thread, so all access is
+    serialized with a lock.
+
+    For each request name this tracks the time spent waiting in the queue, the
+    time spent executing, the total latency and the number of failures. It
+    also tracks the API calls (pages) made per method, the bytes received, the
+    depth of the request queue, the hit rate of the result cache and how
+    results are batched when they're delivered to the main thread.
+    """
+    def __init__(self):
+        self.lock = Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.started = time.time()
+            self.requests = {}
+            self.api_calls = {}
+            self.bytes_received = 0
+            self.cache_hits = 0
+            self.cache_misses = 0
+            self.queue_depth = 0
+            self.max_queue_depth = 0
+            self.dispatch_batches = 0
+            self.dispatch_results = 0
+            self.max_dispatch_batch = 0
+
+    def record_request(self, name, queued, executed, success):
+        """
+        Record a request that was serviced; queued and executed are the number
+        of seconds it spent in the queue and executing.
+        """
+        with self.lock:
+            stats = self.requests.get(name)
+            if stats is None:
+                stats = self.requests[name] = {
+                    "queued": Histogram(),
+                    "executed": Histogram(),
+                    "latency": Histogram(),
+                    "failures": 0
+                }
+
+            stats["queued"].add(queued * 1000)
+            stats["executed"].add(executed * 1000)
+            stats["latency"].add((queued + executed) * 1000)
+            if not success:
+                stats["failures"] += 1
+
+    def record_api_call(self, method):
+        with self.lock:
+            self.api_calls[method] = self.api_calls.get(method, 0) + 1
+
+    def record_bytes(self, count):
+        with self.lock:
+            self.bytes_received += count
+
+    def record_cache(self, hit):
+        with self.lock:
+            if hit:
+                self.cache_hits += 1
+            else:
+                self.cache_misses += 1
+
+    def record_queue_depth(self, depth):
+        with self.lock:
+            self.queue_depth = depth
+            self.max_queue_depth = max(self.max_queue_depth, depth)
+
+    def record_dispatch(self, delivered):
+        """
+        Record a batch of results that was delivered to the main thread.
+        """
+        with self.lock:
+            self.dispatch_batches += 1
+            self.dispatch_results += delivered
+            self.max_dispatch_batch = max(self.max_dispatch_batch, delivered)
+
+    def snapshot(self):
+        """
+        Return the current metrics as a dictionary that can be converted to
+        JSON.
+        """
+        with self.lock:
+            lookups = self.cache_hits + self.cache_misses
+            return {
+                "uptime_s": round(time.time() - self.started, 1),
+                "requests": {name: {
+                    "queued": stats["queued"].to_dict(),
+                    "executed": stats["executed"].to_dict(),
+                    "latency": stats["latency"].to_dict(),
+                    "failures": stats["failures"]
+                } for name, stats in self.requests.items()},
+                "api_calls": dict(self.api_calls),
+                "bytes_received": self.bytes_received,
+                "cache": {
+                    "hits": self.cache_hits,
+                    "misses": self.cache_misses,
+                    "hit_ratio": round(self.cache_hits / lookups, 3) if lookups else 0.0
+                },
+                "queue": {
+                    "depth": self.queue_depth,
+                    "max_depth": self.max_queue_depth
+                },
+                "dispatch": {
+                    "batches": self.dispatch_batches,
+                    "results": self.dispatch_results,
+                    "max_batch": self.max_dispatch_batch
+                }
+            }
+
+
+###----------------------------------------------------------------------------
+
+
+def format_report(snapshot):
+    """
+    Given a metrics snapshot (and optionally transport and quota sections),
+    return a plain text report of it.
+    """
+    lines = ["Network metrics (uptime %.1fs)" % snapshot["uptime_s"], ""]
+
+    lines.append("%-20s %6s %6s %9s %9s %9s %9s %9s" % (
+        "Request", "Count", "Fail", "Queued", "Exec", "p50", "p95", "Max"))
+    for name, stats in sorted(snapshot["requests"].items()):
+        latency = stats["latency"]
+        lines.append("%-20s %6d %6d %7.1fms %7.1fms %7.0fms %7.0fms %7.0fms" % (
+            name, latency["count"], stats["failures"],
+            stats["queued"]["mean_ms"], stats["executed"]["mean_ms"],
+            latency["p50_ms"], latency["p95_ms"], latency["max_ms"]))
+
+    lines.append("")
+    lines.append("API calls (pages fetched):")
+    for method, calls in sorted(snapshot["api_calls"].items()):
+        lines.append("  %-30s %6d" % (method, calls))
+
+    cache = snapshot["cache"]
+    lines.append("")
+    lines.append("Bytes received: %d" % snapshot["bytes_received"])
+    lines.append("Cache: %d hits, %d misses (%.1f%% hit ratio)" % (
+        cache["hits"], cache["misses"], cache["hit_ratio"] * 100))
+    lines.append("Queue depth: %d (max %d)" % (
+        snapshot["queue"]["depth"], snapshot["queue"]["max_depth"]))
+    lines.append("Results delivered: %d in %d batches (max %d per batch)" % (
+        snapshot["dispatch"]["results"], snapshot["dispatch"]["batches"],
+        snapshot["dispatch"]["max_batch"]))
+
+    if "transport" in snapshot:
+        lines.append("")
+        lines.append("Connections:")
+        for idx, conn in enumerate(snapshot["transport"]):
+            lines.append("  #%d: %d requests, %d connects, %d reused" % (
+                idx, conn["requests"], conn["connects"], conn["reused"]))
+
+    if "quota" in snapshot:
+        quota = snapshot["quota"]
+        lines.append("")
+        lines.append("Quota used on %s: %d units" % (quota["day"], quota["used"]))
+
+    return "\n".join(lines)
+
+
+###----------------------------------------------------------------------------
@@ -1,24 +1,28 @@
 import sublime
 import sublime_plugin
 
-from threading import Thread, Event, Lock
-import queue
+from threading import Thread, Timer, Lock, Condition, Semaphore, local, get_ident
+from contextlib import contextmanager
+from collections import deque
+from itertools import count
+import heapq
 
 import os
 import json
+import hashlib
 import textwrap
+import datetime
+import time
+import random
+import traceback
 
-# A compatible version of this is available in hashlib in more recent builds of
-# Python, but it takes keyword only arguments. You can swap to that one by
-# modifying the call site as appropriate.
-from pyscrypt import hash as scrypt
-import pyaes
+from .video_index import VideoIndex
+from .metrics import NetworkMetrics
+from .thumbnails import ThumbnailCache
 
-import google.oauth2.credentials
-import google_auth_oauthlib.flow
-from googleapiclient.discovery import build
-from googleapiclient.errors import HttpError
-from google_auth_oauthlib.flow import InstalledAppFlow
+# NOTE: The Google API client libraries are a large import graph, so they are
+# only imported on demand from within the network thread the first time they
+# are needed, rather than when the plugin is loaded.
 
 
 ###----------------------------------------------------------------------------
@@ -50,40 +54,180 @@ SCOPES = ['https://www.googleapis.com/auth/youtube.readonly']
 API_SERVICE_NAME = 'youtube'
 API_VERSION = 'v3'
 
+# Request priorities; requests with a lower value are serviced first. Requests
+# that the user is actively waiting on are interactive; anything that can wait
+# (such as prefetching) should be submitted as a background request.
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BACKGROUND = 10
+
+# Where the discovery document for the API is fetched from, and how long (in
+# seconds) the locally cached copy is used before it's fetched again.
+DISCOVERY_URI = "https://www.googleapis.com/discovery/v1/apis/{api}/{version}/rest"
+DISCOVERY_MAX_AGE = 7 * 24 * 60 * 60
+
+# The version of the format of the cached discovery document; changing this
+# invalidates any existing cached document.
+_DISCOVERY_CACHE_VERSION = 1
+
+# The most video ID's that the API allows to be looked up in a single call,
+# and the most of those calls that are combined into one batch HTTP request.
+API_MAX_IDS = 50
+BATCH_MAX_REQUESTS = 20
+
+# The parts of a video resource that are fetched for video details.
+VIDEO_DETAIL_PARTS = "snippet,contentDetails,statistics,status"
+
+# The largest page size that the API allows when listing playlist items, and
+# the fields of the response that we actually use when we do so.
+PLAYLIST_PAGE_SIZE = 50
+PLAYLIST_FIELDS = "nextPageToken,items(snippet(title,description,publishedAt,resourceId/videoId))"
+
+# How long (in seconds) incremental fetches of a playlist are merged into its
+# snapshot before a full fetch is made, to pick up removed and renamed videos.
+SNAPSHOT_MAX_AGE = 24 * 60 * 60
+
+# The version of the format of stored playlist snapshots; changing this
+# invalidates any existing snapshot.
+_SNAPSHOT_VERSION = 2
+
+# The number of quota units that each API method costs; anything not listed
+# costs a single unit. See https://developers.google.com/youtube/v3/determine_quota_cost
+API_QUOTA_COSTS = {
+    "youtube.search.list": 100,
+}
+
+# The number of quota units the API allows per day, and how many of those are
+# held in reserve for interactive requests; background requests are refused
+# once only the reserve remains.
+DAILY_QUOTA = 10000
+QUOTA_RESERVE = 1000
+
+# The API quota resets at midnight Pacific time; the daily quota ledger uses
+# this (fixed) offset from UTC to know what day it is.
+QUOTA_UTC_OFFSET = -8 * 60 * 60
+
+# API calls are rate limited to this many quota units per second on average,
+# with bursts of up to RATE_LIMIT_BURST units.
+RATE_LIMIT_RATE = 10
+RATE_LIMIT_BURST = 50
+
+# API calls that fail with a transient error are retried up to this many
+# times, backing off exponentially (with jitter) from RETRY_BASE_DELAY seconds
+# to at most RETRY_MAX_DELAY seconds between attempts.
+RETRY_LIMIT = 5
+RETRY_BASE_DELAY = 1.0
+RETRY_MAX_DELAY = 32.0
+
+# Results are delivered to the main thread in batches; each batch runs for at
+# most this many seconds, and batches are at least this many milliseconds
+# apart.
+DISPATCH_BUDGET = 0.008
+DISPATCH_INTERVAL = 16
+
+# How often (in milliseconds) the stored credentials file is checked to see
+# if it has been added or removed behind our back.
+CREDENTIALS_CHECK_INTERVAL = 5000
+
+# The timeout (in seconds) for the HTTP connections used to talk to the API.
+HTTP_TIMEOUT = 30
+
+# Access tokens are refreshed when they are this close to expiring, so that a
+# request never goes out with a token that expires while it's in flight.
+TOKEN_REFRESH_MARGIN = datetime.timedelta(minutes=5)
+
+# The format that token expiration times are stored in within the cached
+# credentials; they are always in UTC.
+_EXPIRY_FORMAT = "%Y-%m-%dT%H:%M:%S"
+
 # The PBKDF Salt value; it needs to be in bytes.
 _PBKDF_Salt = "YouTuberizerSaltValue".encode()
 
-# The encoded password; later the user will be prompted for this on the fly,
-# but for expediency in testing the password is currently hard coded.
-_PBKDF_Key = scrypt("password".encode(), _PBKDF_Salt, 1024, 1, 1, 32)
+# The initial counter block for AES in CTR mode; this is the default used by
+# pyaes, which encrypted the first versions of the credentials file, so all
+# cipher backends need to use it.
+_CTR_Counter = (1).to_bytes(16, "big")
+
+# The levels of log messages; messages below the current level (see
+# set_log_level()) are thrown away without being formatted.
+LOG_DEBUG = 10
+LOG_INFO = 20
+LOG_WARNING = 30
+LOG_ERROR = 40
+
+LOG_LEVELS = {
+    "debug": LOG_DEBUG,
+    "info": LOG_INFO,
+    "warning": LOG_WARNING,
+    "error": LOG_ERROR
+}
+
+# Log messages are buffered and written out in one batch at most this often
+# (in milliseconds).
+LOG_FLUSH_INTERVAL = 50
+
+# The output panel is trimmed back to three quarters of this many characters
+# whenever it grows larger than this.
+LOG_PANEL_MAX_SIZE = 256 * 1024
+
+# The password the key is derived from; later the user will be prompted for
+# this on the fly, but for expediency in testing the password is currently hard
+# coded.
+_PBKDF_Password = "password".encode()
 
 
 ###----------------------------------------------------------------------------
 
 
-def log(msg, *args, dialog=False, error=False, panel=False, **kwargs):
+class LogBuffer():
     """
-    Generate a log message to the console, and then also optionally to a dialog
-    or dedocated output panel.
+    Collect log messages from any thread and write them out in batches from
+    the main thread, so that a lot of logging costs one print and one append
+    to the output panel per batch instead of one per message.
+    """
+    def __init__(self):
+        self.lock = Lock()
+        self.console = []
+        self.panel = []
+        self.scheduled = False
 
-    The message will be formatted and dedented before being displayed and will
-    have a prefix that indicates where it's coming from.
+    def add(self, lines, panel_text=None):
+        """
+        Add lines for the console and optionally text for the output panel to
+        the next batch.
+        """
+        with self.lock:
+            self.console.extend(lines)
+            if panel_text is not None:
+                self.panel.append(panel_text)
 
-    """
-    msg = textwrap.dedent(msg.format(*args, **kwargs)).strip()
+            if self.scheduled:
+                return
 
-    # sublime.error_message() always displays its content in the console
-    if error:
-        print("YouTuberizer:")
-        return sublime.error_message(msg)
+            self.scheduled = True
 
-    for line in msg.splitlines():
-        print("YouTuberizer: {msg}".format(msg=line))
+        sublime.set_timeout(self.flush, LOG_FLUSH_INTERVAL)
 
-    if dialog:
-        sublime.message_dialog(msg)
+    def flush(self):
+        """
+        Write out everything that has been buffered; this is invoked in the
+        main thread.
+        """
+        with self.lock:
+            console, self.console = self.console, []
+            panel, self.panel = self.panel, []
+            self.scheduled = False
 
-    if panel:
+        if console:
+            print("\n".join(console))
+
+        if panel:
+            self.write_panel("\n".join(panel) + "\n")
+
+    def write_panel(self, text):
+        """
+        Append text to the output panel, creating and showing it if needed and
+        trimming old content if it has grown too large.
+        """
         window = sublime.active_window()
         if "output.youtuberizer" not in window.panels():
             view = window.create_output_panel("youtuberizer")
@@ -94,11 +238,100 @@ def log(msg, *args, dialog=False, error=False, panel=False, **kwargs):
 
         view = window.find_output_panel("youtuberizer")
         view.run_command("append", {
-            "characters": msg + "\n",
+            "characters": text,
             "force": True,
             "scroll_to_end": True})
 
-        window.run_command("show_panel", {"panel": "output.youtuberizer"})
+        if view.size() > LOG_PANEL_MAX_SIZE:
+            view.run_command("youtuberizer_trim_log", {"size": LOG_PANEL_MAX_SIZE * 3 // 4})
+
+        if window.active_panel() != "output.youtuberizer":
+            window.run_command("show_panel", {"panel": "output.youtuberizer"})
+
+
+_log_buffer = LogBuffer()
+
+
+def set_log_level(level):
+    """
+    Set the level of the messages to log, by name; see LOG_LEVELS.
+    """
+    log.level = LOG_LEVELS.get(level, LOG_INFO)
+
+
+def log(msg, *args, level=LOG_INFO, dialog=False, error=False, panel=False, **kwargs):
+    """
+    Generate a log message to the console, and then also optionally to a dialog
+    or dedocated output panel.
+
+    The message will be formatted and dedented before being displayed and will
+    have a prefix that indicates where it's coming from. Messages that only go
+    to the console are dropped if their level is below the current log level.
+
+    Console and output panel messages are buffered and written out in batches;
+    see LogBuffer.
+    """
+    if level < log.level and not (dialog or error or panel):
+        return
+
+    msg = textwrap.dedent(msg.format(*args, **kwargs)).strip()
+
+    # sublime.error_message() always displays its content in the console
+    if error:
+        print("YouTuberizer:")
+        return sublime.error_message(msg)
+
+    lines = ["YouTuberizer: {msg}".format(msg=line) for line in msg.splitlines()]
+    _log_buffer.add(lines, msg if panel else None)
+
+    if dialog:
+        sublime.message_dialog(msg)
+
+
+log.level = LOG_INFO
+
+
+def derive_key(password, salt):
+    """
+    Derive an encryption key from the given password and salt using scrypt.
+
+    Newer versions of Python provide scrypt natively in hashlib, which is
+    considerably faster than the pure Python version in pyscrypt; that is only
+    used (and imported) when the native version is not available.
+    """
+    native_scrypt = getattr(hashlib, "scrypt", None)
+    if native_scrypt is not None:
+        return native_scrypt(password, salt=salt, n=1024, r=1, p=1, dklen=32)
+
+    from pyscrypt import hash as scrypt
+    return scrypt(password, salt, 1024, 1, 1, 32)
+
+
+def pbkdf_key():
+    """
+    Obtain the key used to encrypt and decrypt the cached credentials.
+
+    Key derivation is deliberately expensive, so the key is derived the first
+    time it's needed rather than at load time, and then cached for the rest of
+    the session.
+    """
+    with pbkdf_key.lock:
+        if pbkdf_key.key is None:
+            pbkdf_key.key = derive_key(_PBKDF_Password, _PBKDF_Salt)
+
+        return pbkdf_key.key
+
+pbkdf_key.key = None
+pbkdf_key.lock = Lock()
+
+
+def cache_file_path(filename):
+    """
+    Obtain the full path to a file with the given name in the Cache folder of
+    the User's configuration information.
+    """
+    path = os.path.join(sublime.packages_path(), "..", "Cache", filename)
+    return os.path.normpath(path)
 
 
 def stored_credentials_path():
@@ -110,29 +343,200 @@ def stored_credentials_path():
     if hasattr(stored_credentials_path, "path"):
         return stored_credentials_path.path
 
-    path = os.path.join(sublime.packages_path(), "..", "Cache", "YouTuberizer.credentials")
-    stored_credentials_path.path = os.path.normpath(path)
+    stored_credentials_path.path = cache_file_path("YouTuberizer.credentials")
 
     return stored_credentials_path.path
 
 
+def write_json_file(path, data):
+    """
+    Write the given data to a file as JSON. This writes to a temporary file
+    first and moves it into place, so that the file is never half written;
+    the temporary file is unique to the calling thread.
+    """
+    temp_path = "%s.%d.tmp" % (path, get_ident())
+    with open(temp_path, "w", encoding="utf-8") as handle:
+        json.dump(data, handle)
+
+    os.replace(temp_path, path)
+
+
+def _load_discovery_cache(path, uri):
+    """
+    Load the discovery document cached in the given file, returning None if
+    there isn't one or it's not usable because it's for a different URI, is in
+    an older format, or is too old.
+    """
+    try:
+        with open(path, "r", encoding="utf-8") as handle:
+            cached = json.load(handle)
+
+        if (cached["version"] == _DISCOVERY_CACHE_VERSION and cached["uri"] == uri
+                and time.time() - cached["fetched"] < DISCOVERY_MAX_AGE):
+            return cached["document"]
+
+    except (OSError, ValueError, KeyError, TypeError):
+        pass
+
+    return None
+
+
+def _fetch_discovery_document(uri):
+    """
+    Fetch the discovery document from the given URI and return it parsed.
+    """
+    import httplib2
+    from googleapiclient.errors import HttpError
+
+    response, content = httplib2.Http(timeout=HTTP_TIMEOUT).request(uri)
+    if response.status >= 400:
+        raise HttpError(response, content, uri=uri)
+
+    return json.loads(content.decode("utf-8"))
+
+
+def discovery_document():
+    """
+    Obtain the parsed discovery document that describes the YouTube API. This
+    is cached on disk in the Cache folder alongside the credentials and is
+    only fetched again once the cached copy gets too old. The parsed document
+    is kept in memory for the rest of the session.
+    """
+    with discovery_document.lock:
+        if discovery_document.document is None:
+            uri = DISCOVERY_URI.format(api=API_SERVICE_NAME, version=API_VERSION)
+            path = cache_file_path("YouTuberizer.discovery.json")
+
+            document = _load_discovery_cache(path, uri)
+            if document is None:
+                document = _fetch_discovery_document(uri)
+
+                write_json_file(path, {
+                    "version": _DISCOVERY_CACHE_VERSION,
+                    "uri": uri,
+                    "fetched": time.time(),
+                    "document": document
+                })
+
+            discovery_document.document = document
+
+        return discovery_document.document
+
+discovery_document.document = None
+discovery_document.lock = Lock()
+
+
+class PyAESCipher():
+    """
+    Encrypt and decrypt data with AES in CTR mode using pyaes, which is pure
+    Python and so always available, but slow.
+    """
+    name = "pyaes"
+
+    @classmethod
+    def available(cls):
+        return True
+
+    def __init__(self, key):
+        import pyaes
+        self.mode = lambda: pyaes.AESModeOfOperationCTR(key,
+                                pyaes.Counter(int.from_bytes(_CTR_Counter, "big")))
+
+    def encrypt(self, data):
+        return self.mode().encrypt(data)
+
+    def decrypt(self, data):
+        return self.mode().decrypt(data)
+
+
+class CryptographyCipher():
+    """
+    Encrypt and decrypt data with AES in CTR mode using the cryptography
+    package, which is backed by native code. This is only available if that
+    package is installed.
+    """
+    name = "cryptography"
+
+    @classmethod
+    def available(cls):
+        try:
+            import cryptography.hazmat.primitives.ciphers
+            return True
+        except ImportError:
+            return False
+
+    def __init__(self, key):
+        from cryptography.hazmat.backends import default_backend
+        from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+
+        self.cipher = lambda: Cipher(algorithms.AES(key), modes.CTR(_CTR_Counter),
+                                     backend=default_backend())
+
+    def encrypt(self, data):
+        encryptor = self.cipher().encryptor()
+        return encryptor.update(data) + encryptor.finalize()
+
+    def decrypt(self, data):
+        decryptor = self.cipher().decryptor()
+        return decryptor.update(data) + decryptor.finalize()
+
+
+# The cipher implementations that can be used to encrypt cached credentials,
+# in order of preference; the first one that's available is used.
+_cipher_backends = [CryptographyCipher, PyAESCipher]
+
+
+def credentials_cipher():
+    """
+    Obtain the cipher object used to encrypt and decrypt the cached credentials;
+    this is the first available backend in _cipher_backends, created the first
+    time it's needed.
+    """
+    with credentials_cipher.lock:
+        if credentials_cipher.cipher is None:
+            backend = next(b for b in _cipher_backends if b.available())
+            credentials_cipher.cipher = backend(pbkdf_key())
+
+        return credentials_cipher.cipher
+
+credentials_cipher.cipher = None
+credentials_cipher.lock = Lock()
+
+
+def _credentials_stamp(path):
+    """
+    Return a value that changes whenever the credentials file at the given
+    path changes; this raises FileNotFoundError if the file does not exist.
+    """
+    info = os.stat(path)
+    return (info.st_mtime_ns, info.st_size)
+
+
 def cache_credentials(credentials):
     """
     Given a credentials object, cache the given credentials into a file in the
-    Cache directory for later use.
+    Cache directory for later use. Like write_json_file(), this writes to a
+    temporary file and moves it into place, so the file is never half written.
     """
     cache_data = {
         "token": credentials.token,
         "refresh_token": credentials.refresh_token,
-        "id_token": credentials.id_token
+        "id_token": credentials.id_token,
+        "expiry": (credentials.expiry.strftime(_EXPIRY_FORMAT)
+                   if credentials.expiry is not None else None)
     }
 
     # Encrypt the cache data using our key and write it out as bytes.
-    aes = pyaes.AESModeOfOperationCTR(_PBKDF_Key)
-    cache_data = aes.encrypt(json.dumps(cache_data, indent=4))
+    encrypted = credentials_cipher().encrypt(json.dumps(cache_data, indent=4).encode("utf-8"))
 
-    with open(stored_credentials_path(), "wb") as handle:
-        handle.write(cache_data)
+    path = stored_credentials_path()
+    temp_path = "%s.%d.tmp" % (path, get_ident())
+    with open(temp_path, "wb") as handle:
+        handle.write(encrypted)
+
+    os.replace(temp_path, path)
+
+    get_cached_credentials.cache = (_credentials_stamp(path), cache_data)
 
 
 def get_cached_credentials():
@@ -140,19 +544,30 @@ def get_cached_credentials():
     Fetch the cached credentials from a previous operation; this will return
     None if there is currently no cached credentials. This will currently
     raise an exception if the file is broken (so don't break it).
+
+    The decrypted credentials are kept in memory and only read from disk again
+    if the file changes.
     """
+    path = stored_credentials_path()
     try:
-        # Decrypt the data with the key and convert it back to JSON.
-        with open(stored_credentials_path(), "rb") as handle:
-            aes = pyaes.AESModeOfOperationCTR(_PBKDF_Key)
-            cache_data = aes.decrypt(handle.read()).decode("utf-8")
+        stamp = _credentials_stamp(path)
+        if get_cached_credentials.cache[0] == stamp:
+            cached = get_cached_credentials.cache[1]
+        else:
+            # Decrypt the data with the key and convert it back to JSON.
+            with open(path, "rb") as handle:
+                cache_data = credentials_cipher().decrypt(handle.read()).decode("utf-8")
 
             cached = json.loads(cache_data)
+            get_cached_credentials.cache = (stamp, cached)
 
     except FileNotFoundError:
+        get_cached_credentials.cache = (None, None)
         return None
 
-    return google.oauth2.credentials.Credentials(
+    import google.oauth2.credentials
+
+    credentials = google.oauth2.credentials.Credentials(
         cached["token"],
         cached["refresh_token"],
         cached["id_token"],
@@ -162,22 +577,76 @@ def get_cached_credentials():
         SCOPES
     )
 
+    # Credentials cached by older versions don't know when they expire.
+    if cached.get("expiry") is not None:
+        credentials.expiry = datetime.datetime.strptime(cached["expiry"], _EXPIRY_FORMAT)
 
-# Authorize the request and store authorization credentials.
-def get_authenticated_service():
+    return credentials
+
+get_cached_credentials.cache = (None, None)
+
+
+def credentials_need_refresh(credentials):
     """
-    This builds the appropriate endpoint object to talk to the YouTube data
-    API, using a combination of the client secrets file and either cached
-    credentials or asking the user to log in first.
+    Given a credentials object, return an indication of whether the access
+    token has expired or will do so within TOKEN_REFRESH_MARGIN. Credentials
+    with no known expiry time are assumed to be good; if they're not, the
+    transport refreshes them when the API rejects the token.
+    """
+    if not credentials.valid:
+        return True
 
-    If there is no cached credentials, or if they are not valid, then the user
-    is asked to log in again before this returns.
+    if credentials.expiry is None:
+        return False
 
-    The result is an object that can be used to make requests to the API.
-    This fetches the authenticated service for use
+    return credentials.expiry - datetime.datetime.utcnow() < TOKEN_REFRESH_MARGIN
+
+
+def refresh_credentials(credentials):
+    """
+    Use the refresh token in the given credentials to obtain a new access
+    token, caching the updated credentials on success. The return value is
+    False if the refresh token was rejected, in which case the user needs to
+    log in again.
+    """
+    import google.auth.exceptions
+    import google_auth_httplib2
+    import httplib2
+
+    if not credentials.refresh_token:
+        return False
+
+    try:
+        credentials.refresh(google_auth_httplib2.Request(httplib2.Http(timeout=HTTP_TIMEOUT)))
+    except google.auth.exceptions.RefreshError as err:
+        log("Unable to refresh access token: {0}", err, level=LOG_WARNING)
+        return False
+
+    cache_credentials(credentials)
+    return True
+
+
+def get_authorized_credentials(interactive=True):
+    """
+    Obtain credentials that can be used to talk to the YouTube API. Cached
+    credentials are used if possible, refreshing the access token if needed;
+    only if there are no cached credentials or the refresh fails is the user
+    asked to log in again before this returns.
+
+    When interactive is False, the user is never asked to log in; a ValueError
+    is raised instead.
     """
     credentials = get_cached_credentials()
-    if credentials is None or not credentials.valid:
+    if credentials is not None and credentials_need_refresh(credentials):
+        if not refresh_credentials(credentials):
+            credentials = None
+
+    if credentials is None and not interactive:
+        raise ValueError("The stored credentials are not usable; log in again")
+
+    if credentials is None:
+        from google_auth_oauthlib.flow import InstalledAppFlow
+
         # TODO: This can raise exceptions, AccessDeniedError
         flow = InstalledAppFlow.from_client_config(CLIENT_CONFIG, SCOPES)
         credentials = flow.run_local_server(client_type="installed",
@@ -186,7 +655,299 @@ def get_authenticated_service():
 
         cache_credentials(credentials)
 
-    return build(API_SERVICE_NAME, API_VERSION, credentials = credentials)
+    return credentials
+
+
+# Authorize the request and store authorization credentials.
+def get_authenticated_service(credentials=None):
+    """
+    This builds the appropriate endpoint object to talk to the YouTube data
+    API, using the credentials provided, or the result of calling
+    get_authorized_credentials() if none are given; see that function for
+    details on how the credentials are obtained.
+
+    The service is built from the locally cached discovery document; see
+    discovery_document().
+
+    The result is an object that can be used to make requests to the API.
+    """
+    from googleapiclient.discovery import build_from_document
+
+    if credentials is None:
+        credentials = get_authorized_credentials()
+
+    return build_from_document(discovery_document(), credentials = credentials)
+
+
+###----------------------------------------------------------------------------
+
+
+class PooledHttp():
+    """
+    A wrapper around an httplib2.Http object, which keeps connections alive
+    and re-uses them for subsequent requests to the same host. This counts the
+    requests made and the connections opened to service them, so that we can
+    tell how often a connection was re-used.
+    """
+    def __init__(self, timeout, metrics=None):
+        import httplib2
+
+        self.http = httplib2.Http(timeout=timeout)
+        self.metrics = metrics
+        self.requests = 0
+        self.connects = 0
+
+        pool = self
+        class HTTPConnection(httplib2.HTTPConnectionWithTimeout):
+            def connect(self):
+                pool.connects += 1
+                super().connect()
+
+        class HTTPSConnection(httplib2.HTTPSConnectionWithTimeout):
+            def connect(self):
+                pool.connects += 1
+                super().connect()
+
+        self.connection_types = {"http": HTTPConnection, "https": HTTPSConnection}
+
+    def __getattr__(self, name):
+        return getattr(self.http, name)
+
+    def request(self, uri, *args, **kwargs):
+        self.requests += 1
+        if kwargs.get("connection_type") is None:
+            scheme = uri.split(":", 1)[0].lower()
+            kwargs["connection_type"] = self.connection_types.get(scheme)
+
+        response, content = self.http.request(uri, *args, **kwargs)
+        if self.metrics is not None:
+            self.metrics.record_bytes(len(content or b""))
+
+        return response, content
+
+    def close(self):
+        for connection in self.http.connections.values():
+            connection.close()
+
+
+class HttpTransport():
+    """
+    The transport that API requests are executed over. This is a pool of
+    authorized HTTP objects, each of which keeps its connections alive between
+    requests.
+
+    An HTTP object is not thread safe, so each one is only ever used by one
+    worker at a time; the pool is sized to the number of workers, and a worker
+    that asks for a connection while all of them are in use will block.
+    """
+    def __init__(self, credentials, size=1, timeout=HTTP_TIMEOUT, metrics=None):
+        self.credentials = credentials
+        self.timeout = timeout
+        self.metrics = metrics
+        self.size = size
+        self.lock = Lock()
+        self.available = Semaphore(size)
+        self.pool = []
+        self.idle = []
+
+    @contextmanager
+    def connection(self):
+        """
+        Check out an authorized HTTP object from the pool for the duration of
+        the context; the most recently used object is preferred, since it is
+        the most likely to have a connection that is still alive.
+        """
+        import google_auth_httplib2
+
+        with self.available:
+            with self.lock:
+                entry = self.idle.pop() if self.idle else None
+
+                if entry is None:
+                    pooled = PooledHttp(self.timeout, self.metrics)
+                    entry = (pooled, google_auth_httplib2.AuthorizedHttp(
+                        self.credentials, http=pooled))
+                    self.pool.append(entry)
+
+            try:
+                yield entry[1]
+            finally:
+                with self.lock:
+                    self.idle.append(entry)
+
+    def stats(self):
+        """
+        Return a list of the usage statistics for each HTTP object in the pool;
+        each is a dictionary with the number of requests made, connections
+        opened, and requests that re-used an existing connection.
+        """
+        with self.lock:
+            return [{
+                "requests": pooled.requests,
+                "connects": pooled.connects,
+                "reused": max(0, pooled.requests - pooled.connects)
+            } for pooled, _ in self.pool]
+
+    def close(self):
+        """
+        Close all of the connections that are being kept alive.
+        """
+        with self.lock:
+            for pooled, _ in self.pool:
+                pooled.close()
+
+
+###----------------------------------------------------------------------------
+
+
+class QuotaExceededError(Exception):
+    """
+    Raised when an API call is not made because it would use more of the
+    daily API quota than is available to it.
+    """
+    pass
+
+
+def _http_error_reason(err):
+    """
+    Given an HttpError, return the reason given for the error in the response
+    body, if there is one.
+    """
+    try:
+        content = json.loads(err.content.decode("utf-8"))
+        return content["error"]["errors"][0]["reason"]
+    except (ValueError, KeyError, IndexError, TypeError, AttributeError):
+        return None
+
+
+def is_retryable_error(err):
+    """
+    Given an exception raised while making an API call, return an indication
+    of whether the call should be retried; this is the case for network errors,
+    server errors and rate limiting, but not for exceeding the daily quota or
+    other client errors.
+    """
+    import httplib2
+    from googleapiclient.errors import HttpError
+
+    if isinstance(err, HttpError):
+        status = err.resp.status
+        if status == 403:
+            return _http_error_reason(err) in ("rateLimitExceeded", "userRateLimitExceeded")
+
+        return status in (429, 500, 502, 503, 504)
+
+    return isinstance(err, (OSError, httplib2.HttpLib2Error))
+
+
+def retry_delay(attempt):
+    """
+    Return how long to wait before making the given retry attempt (starting at
+    0); this backs off exponentially, with full jitter so that retries from
+    several requests don't all happen at once.
+    """
+    return random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * (2 ** attempt)))
+
+
+class RateLimiter():
+    """
+    A token bucket rate limiter, where the tokens are API quota units; every
+    API call takes as many tokens as the call costs. Tokens are added at a
+    fixed rate up to the size of the bucket, which allows for short bursts of
+    calls while keeping the average rate down.
+    """
+    def __init__(self, rate=RATE_LIMIT_RATE, capacity=RATE_LIMIT_BURST):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = Lock()
+
+    def reserve(self, cost):
+        """
+        Take the given number of tokens from the bucket, returning how many
+        seconds the caller needs to wait before making the call; this is 0
+        unless the bucket has run dry.
+        """
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+            self.tokens -= cost
+            return 0 if self.tokens >= 0 else -self.tokens / self.rate
+
+
+class QuotaLedger():
+    """
+    Keep track of the API quota units used today, persisting the running total
+    to a file so that it survives restarts. The ledger resets itself when the
+    day changes.
+    """
+    def __init__(self, path, limit=DAILY_QUOTA, reserve=QUOTA_RESERVE):
+        self.path = path
+        self.limit = limit
+        self.reserve = reserve
+        self.lock = Lock()
+        self.ledger = None
+        self.saved = 0
+
+    def today(self):
+        return time.strftime("%Y-%m-%d", time.gmtime(time.time() + QUOTA_UTC_OFFSET))
+
+    def current(self):
+        """
+        Get the ledger for today, loading it if needed; the caller must be
+        holding the lock.
+        """
+        today = self.today()
+        if self.ledger is None:
+            try:
+                with open(self.path, "r", encoding="utf-8") as handle:
+                    self.ledger = json.load(handle)
+            except (OSError, ValueError):
+                pass
+
+        if not isinstance(self.ledger, dict) or self.ledger.get("day") != today:
+            self.ledger = {"day": today, "used": 0, "methods": {}}
+
+        return self.ledger
+
+    def charge(self, method, cost, background=False):
+        """
+        Record that an API call to the given method costing the given number
+        of units is about to be made. This raises QuotaExceededError instead
+        if there is not enough quota left for it; background calls can't use
+        the units that are held in reserve.
+        """
+        with self.lock:
+            ledger = self.current()
+            available = self.limit - (self.reserve if background else 0)
+            if ledger["used"] + cost > available:
+                raise QuotaExceededError(
+                    "Daily YouTube API quota exhausted (%d of %d units used)" % (
+                        ledger["used"], self.limit))
+
+            ledger["used"] += cost
+            ledger["methods"][method] = ledger["methods"].get(method, 0) + cost
+
+        # Writing the ledger after every call would be wasteful, so it's only
+        # written every so often (and at shutdown).
+        if time.monotonic() - self.saved > 5:
+            self.save()
+
+    def usage(self):
+        """
+        Return a copy of the ledger for today.
+        """
+        with self.lock:
+            return json.loads(json.dumps(self.current()))
+
+    def save(self):
+        with self.lock:
+            if self.ledger is not None:
+                self.saved = time.monotonic()
+                write_json_file(self.path, self.ledger)
 
 
 ###----------------------------------------------------------------------------
@@ -194,41 +955,305 @@ def get_authenticated_service():
 
 class Request(dict):
     """
-    Simple wrapper for a request object. This is essentially a hashable
-    dictionary object that doesn't throw exceptions when you attempt to access
-    a key that doesn't exist, and which inherently knows what it's name is.
+    Simple wrapper for a request object. This is essentially an immutable,
+    hashable dictionary object that doesn't throw exceptions when you attempt
+    to access a key that doesn't exist, and which inherently knows what it's
+    name is.
+
+    Requests are used as keys in the result cache, so the hash is calculated
+    once at creation time instead of on every lookup. For the same reason, any
+    list arguments are stored as tuples. The handler only says where the
+    result goes, so it is not part of the key; requests that differ only in
+    their handler are the same request.
     """
     def __init__(self, name, handler=None, **kwargs):
-        super().__init__(self, **kwargs)
-        self.name = name
-        self.handler = handler or '_' + name
+        super().__init__({k: tuple(v) if isinstance(v, list) else v
+                          for k, v in kwargs.items()})
+        dict.__setitem__(self, "_name", name)
+        dict.__setitem__(self, "_handler", handler or '_' + name)
 
-    def __key(self):
-        return tuple((k,self[k]) for k in sorted(self))
+        self.__key = tuple((k, dict.__getitem__(self, k))
+                           for k in sorted(self) if k != "_handler")
+        self.__hash = hash(self.__key)
 
     def __hash__(self):
-        return hash(self.__key())
+        return self.__hash
 
     def __eq__(self, other):
-        return self.__key() == other.__key()
+        if not isinstance(other, Request):
+            return False
+
+        return self.__hash == other.__hash and self.__key == other.__key
 
     def __getitem__(self, key):
         return self.get(key, None)
 
-    def __set_name(self, value):
-        self["_name"] = value
+    def __immutable(self, *args, **kwargs):
+        raise TypeError("Request objects are immutable")
+
+    __setitem__ = __delitem__ = __immutable
+    clear = pop = popitem = setdefault = update = __immutable
 
     def __get_name(self):
         return self.get("_name", None)
 
-    def __set_handler(self, value):
-        self["_handler"] = value
-
     def __get_handler(self):
         return self.get("_handler", None)
 
-    name = property(__get_name, __set_name)
-    handler = property(__get_handler, __set_handler)
+    name = property(__get_name)
+    handler = property(__get_handler)
+
+
+###----------------------------------------------------------------------------
+
+
+class RequestHandle():
+    """
+    A handle for a request that has been submitted to the NetworkManager,
+    which can be used to cancel the request if the result is no longer needed.
+
+    A request that is cancelled while it is still in the queue is dropped
+    without being executed; one that is already executing runs to completion
+    but its result is not delivered to the callback.
+    """
+    def __init__(self, request, priority):
+        self.request = request
+        self.priority = priority
+        self.submitted = time.monotonic()
+        self._cancelled = False
+        self._done = False
+
+    def cancel(self):
+        """
+        Cancel this request; returns False if the request has already been
+        delivered (and thus can't be cancelled), or True otherwise.
+        """
+        if self._done:
+            return False
+
+        self._cancelled = True
+        return True
+
+    def cancelled(self):
+        """
+        Returns an indication of whether this request has been cancelled.
+        """
+        return self._cancelled
+
+    def done(self):
+        """
+        Returns an indication of whether the result of this request has been
+        delivered.
+        """
+        return self._done
+
+    def mark_done(self):
+        """
+        Flag this request as being completed; this is invoked internally when
+        the result is delivered.
+        """
+        self._done = True
+
+
+###----------------------------------------------------------------------------
+
+
+class RequestFlight():
+    """
+    A single execution of a request on behalf of all of the RequestHandles
+    that asked for it while it was pending; the NetworkManager uses this so
+    that making a request that is already queued or executing waits for that
+    result instead of making the request again.
+
+    The flight runs at the most urgent priority of its handles, and it is only
+    cancelled once all of them have been.
+    """
+    def __init__(self, request):
+        self.request = request
+        self.waiters = []
+        self.submitted = time.monotonic()
+
+    def join(self, handle, callback):
+        """
+        Add a handle to this flight; the callback is invoked with the result
+        when the flight is delivered, unless the handle has been cancelled.
+        """
+        self.waiters.append((handle, callback))
+
+    def cancelled(self):
+        """
+        Returns an indication of whether all of the handles in this flight
+        have been cancelled.
+        """
+        return all(handle.cancelled() for handle, callback in self.waiters)
+
+    def __get_priority(self):
+        return min(handle.priority for handle, callback in self.waiters)
+
+    priority = property(__get_priority)
+
+
+###----------------------------------------------------------------------------
+
+
+class RequestQueue():
+    """
+    A priority ordered queue of requests for the network thread to service.
+    Entries with a lower priority value are returned first, and entries of the
+    same priority are returned in the order they were added.
+
+    Entries whose handle has been cancelled are skipped, and closing the queue
+    immediately wakes up anything waiting for an entry.
+    """
+    def __init__(self):
+        self.lock = Lock()
+        self.ready = Condition(self.lock)
+        self.closing = Condition(self.lock)
+        self.entries = []
+        self.sequence = count()
+        self.closed = False
+
+    def __len__(self):
+        with self.lock:
+            return len(self.entries)
+
+    def put(self, item):
+        """
+        Add a new entry to the queue; the item must be a dictionary with a
+        handle key that provides the RequestHandle of the request.
+        """
+        with self.lock:
+            if self.closed:
+                raise ValueError("Request queue is closed")
+
+            entry = (item["handle"].priority, next(self.sequence), item)
+            heapq.heappush(self.entries, entry)
+            self.ready.notify()
+
+    def reprioritize(self, handle):
+        """
+        Update the position of the entry with the given handle to match its
+        current priority; this does nothing if the entry has already been
+        removed from the queue.
+        """
+        with self.lock:
+            for index, (priority, sequence, item) in enumerate(self.entries):
+                if item["handle"] is handle and priority != handle.priority:
+                    self.entries[index] = (handle.priority, sequence, item)
+                    heapq.heapify(self.entries)
+                    break
+
+    def get(self):
+        """
+        Remove and return the highest priority entry from the queue that has
+        not been cancelled, blocking until one is available. The return value
+        is None when the queue has been closed.
+        """
+        with self.lock:
+            while not self.closed:
+                while self.entries:
+                    item = heapq.heappop(self.entries)[2]
+                    if not item["handle"].cancelled():
+                        return item
+
+                self.ready.wait()
+
+        return None
+
+    def close(self):
+        """
+        Close the queue, discarding any pending entries and waking up anything
+        that is blocked waiting for an entry.
+        """
+        with self.lock:
+            self.closed = True
+            self.entries = []
+            self.ready.notify_all()
+            self.closing.notify_all()
+
+    def sleep(self, timeout):
+        """
+        Wait for the given number of seconds, returning early if the queue is
+        closed; the return value indicates whether the queue is closed.
+        """
+        deadline = time.monotonic() + timeout
+        with self.lock:
+            while not self.closed:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+
+                self.closing.wait(remaining)
+
+            return self.closed
+
+
+###----------------------------------------------------------------------------
+
+
+class ResultDispatcher():
+    """
+    Deliver the results of requests to the main thread in batches, so that a
+    lot of network activity does not flood it with tiny callbacks.
+
+    Results are collected in a buffer from any thread and delivered in a
+    single main thread callback. Each batch stops once it has run for its time
+    budget, leaving anything else for the next batch, and batches are spaced
+    apart so that the UI always gets a chance to run in between.
+    """
+    def __init__(self, budget=DISPATCH_BUDGET, interval=DISPATCH_INTERVAL, metrics=None):
+        self.budget = budget
+        self.interval = interval
+        self.metrics = metrics
+        self.lock = Lock()
+        self.pending = deque()
+        self.scheduled = False
+        self.last_drain = 0
+
+    def dispatch(self, callback):
+        """
+        Add a callback to be invoked in the main thread; this can be called
+        from any thread.
+        """
+        with self.lock:
+            self.pending.append(callback)
+            if self.scheduled:
+                return
+
+            self.scheduled = True
+            elapsed = (time.monotonic() - self.last_drain) * 1000
+
+        sublime.set_timeout(self.drain, int(max(0, self.interval - elapsed)))
+
+    def drain(self):
+        """
+        Invoke pending callbacks until they run out or the time budget for
+        this batch is used up, then schedule the next batch if needed. This is
+        invoked in the main thread.
+        """
+        started = time.monotonic()
+        delivered = 0
+        while True:
+            with self.lock:
+                if not self.pending or time.monotonic() - started >= self.budget:
+                    self.last_drain = time.monotonic()
+                    self.scheduled = bool(self.pending)
+                    break
+
+                callback = self.pending.popleft()
+
+            try:
+                callback()
+            except Exception:
+                traceback.print_exc()
+
+            delivered += 1
+
+        if self.metrics is not None:
+            self.metrics.record_dispatch(delivered)
+
+        if self.scheduled:
+            sublime.set_timeout(self.drain, self.interval)
 
 
 ###----------------------------------------------------------------------------
@@ -242,13 +1267,41 @@ class NetworkManager():
 
     There should be a single global instance of this class created; it connects
     the network data gathering with the Sublime front end.
+
+    The engine selects how requests are executed; "thread" uses NetworkThread
+    while "asyncio" uses AsyncNetworkThread, which executes up to the given
+    number of workers at once, failing any that take longer than the given
+    timeout.
     """
-    def __init__(self):
-        self.thr_event = Event()
-        self.request_queue = queue.Queue()
-        self.net_thread = NetworkThread(self.thr_event, self.request_queue)
+    def __init__(self, engine="thread", workers=4, timeout=None):
+        self.request_queue = RequestQueue()
+        self.metrics = NetworkMetrics()
+        self.dispatcher = ResultDispatcher(metrics=self.metrics)
+        self.index = None
+        if VideoIndex.available():
+            self.index = VideoIndex(cache_file_path("YouTuberizer.index.sqlite"))
+        self.thumbnails = ThumbnailCache(cache_file_path("YouTuberizer.thumbnails"),
+                                         self.dispatcher.dispatch,
+                                         lambda msg, *args: log(msg, *args, level=LOG_WARNING))
+
+        if engine == "asyncio" and not AsyncNetworkThread.available():
+            log("asyncio is not available; using the thread network engine")
+            engine = "thread"
+
+        if engine == "asyncio":
+            self.net_thread = AsyncNetworkThread(self.request_queue, self.index,
+                                                 self.metrics, self.dispatcher,
+                                                 workers, timeout, self.login_expired)
+        else:
+            self.net_thread = NetworkThread(self.request_queue, self.index,
+                                            self.metrics, self.dispatcher,
+                                            self.login_expired)
         self.authorized = False
         self.cache = {}
+        self.in_flight = {}
+        self.running = True
+        self.credentials_present = os.path.isfile(stored_credentials_path())
+        sublime.set_timeout_async(self.check_credentials, CREDENTIALS_CHECK_INTERVAL)
 
     def startup(self):
         """
@@ -258,7 +1311,7 @@ class NetworkManager():
         This can be called just prior to the first network operation;
         optionally it can also be invoked from plugin_loaded().
         """
-        log("Spinning up YouTube thread")
+        log("Spinning up YouTube thread", level=LOG_DEBUG)
         self.net_thread.start()
 
     def shutdown(self):
@@ -267,9 +1320,11 @@ class NetworkManager():
         that may be running. This should be called from plugin_unloaded() to do
         cleanup before we go away.
         """
+        self.running = False
+        self.thumbnails.shutdown()
         if self.net_thread.is_alive():
-            log("Terminating YouTube thread")
-            self.thr_event.set()
+            log("Terminating YouTube thread", level=LOG_DEBUG)
+            self.request_queue.close()
             self.net_thread.join(0.25)
 
     def has_credentials(self):
@@ -277,8 +1332,51 @@ class NetworkManager():
         Returns an indication of whether or not there are currently stored
         credentials for a YouTube login; this indicates that the user has
         already authorized the application to access their account.
+
+        This is called every time the menus and command palette are drawn, so
+        it never touches the disk; the state is tracked as logins and logouts
+        happen, and by check_credentials() in case the file changes on disk.
+        """
+        return self.credentials_present
+
+    def check_credentials(self):
+        """
+        Check whether the stored credentials file exists; this runs
+        periodically in Sublime's async thread for as long as the manager is
+        running.
+        """
+        if not self.running:
+            return
+
+        self.credentials_present = os.path.isfile(stored_credentials_path())
+        sublime.set_timeout_async(self.check_credentials, CREDENTIALS_CHECK_INTERVAL)
+
+    def search_videos(self, query):
+        """
+        Search the local index of channel videos for the given query, returning
+        a list of [title, url] items. The index is kept up to date as results
+        come in from the network, so this does not wait on the network; the
+        result is an empty list if there is no index.
+        """
+        if self.index is None:
+            return []
+
+        return self.index.search(query)
+
+    def metrics_snapshot(self):
         """
-        return os.path.isfile(stored_credentials_path())
+        Return a snapshot of the metrics of the network layer as a dictionary
+        that can be converted to JSON; this includes the connection statistics
+        of the transport and the quota used today.
+        """
+        snapshot = self.metrics.snapshot()
+        snapshot["quota"] = self.net_thread.quota.usage()
+
+        transport = self.net_thread.transport
+        if transport is not None:
+            snapshot["transport"] = transport.stats()
+
+        return snapshot
 
     def is_authorized(self):
         """
@@ -288,16 +1386,49 @@ class NetworkManager():
         """
         return self.authorized
 
-    def callback(self, request, user_callback, success, result):
+    def is_pending(self, request):
+        """
+        Returns an indication of whether the given request has been submitted
+        and has not been delivered yet.
+        """
+        flight = self.in_flight.get(request)
+        return flight is not None and not flight.cancelled()
+
+    def login_expired(self):
+        """
+        The network thread was unable to refresh the access token, so queue a
+        request to log in again; requests fail until this completes. This is
+        invoked in the main thread.
+        """
+        def logged_in(request, success, result):
+            if not success:
+                log("Unable to log in again: {0}", result, level=LOG_WARNING)
+
+        log("Your YouTube login has expired; logging in again", level=LOG_WARNING)
+        request = Request("authorize")
+        self.authorized = False
+        self.cache.pop(request, None)
+        self.request(request, logged_in)
+
+    def callback(self, flight, success, result):
         """
         This callback is what is submitted to the network thread to invoke
         when a result is delivered. We get the success and the result, as
-        well as the request that was made and the user callback.
+        well as the flight of the request that was made, which holds the
+        handles and user callbacks of everything waiting on it.
+
+        The internal state is always updated, but the user callback of a
+        handle is not invoked if it was cancelled while the request was
+        executing.
 
         NOTE: The NetworkThread always invokes this in Sublime's main thread,
         not from within itself; this is the barrier where the requested data
         shifts between threads.
         """
+        request = flight.request
+        if self.in_flight.get(request) is flight:
+            del self.in_flight[request]
+
         if success:
             self.cache[request] = result
         elif request in self.cache:
@@ -306,32 +1437,66 @@ class NetworkManager():
         # Handle updates of internal state.
         if request.name == "authorize":
             self.authorized = success
+            self.credentials_present = success or self.credentials_present
         elif request.name == "deauthorize":
             self.authorized = False
+            self.credentials_present = False
             self.cache = dict()
 
-        user_callback(request, success, result)
+        for handle, user_callback in flight.waiters:
+            handle.mark_done()
+            if not handle.cancelled():
+                user_callback(handle.request, success, result)
 
-    def request(self, request, callback, refresh=False):
+    def request(self, request, callback, refresh=False, priority=PRIORITY_INTERACTIVE):
         """
         Submit the given request to the network thread; the thread will execute
         the task and then invoke the callback once complete; the callback gets
         called with a boolean that indicates the success or failure, and either
         the error reason (on fail) or the result (on success).
 
+        Requests are serviced in priority order; see PRIORITY_INTERACTIVE and
+        PRIORITY_BACKGROUND. The return value is a RequestHandle that can be
+        used to cancel the request.
+
         Internally this class will cache the result of some requests; in order
-        to force a re-request, set refresh to True.
+        to force a re-request, set refresh to True. Unless refresh is set, a
+        request that is already pending is not made twice; the callback is
+        invoked with the result of the pending request instead, which is moved
+        up to the priority given here if that is more urgent.
         """
-        if request in self.cache and not refresh:
-            return callback(request, True, self.cache[request])
+        handle = RequestHandle(request, priority)
+        cached = request in self.cache and not refresh
+
+        flight = self.in_flight.get(request)
+        if flight is not None and not flight.cancelled() and not (cached or refresh):
+            self.metrics.record_cache(True)
+            flight.join(handle, callback)
+            self.request_queue.reprioritize(flight)
+            return handle
+
+        self.metrics.record_cache(cached)
+
+        if cached:
+            handle.mark_done()
+            callback(request, True, self.cache[request])
+            return handle
 
         if not self.net_thread.is_alive():
             self.startup()
 
+        flight = RequestFlight(request)
+        flight.join(handle, callback)
+        self.in_flight[request] = flight
+
         self.request_queue.put({
-            "request": request, 
-            "callback": lambda s, r: self.callback(request, callback, s, r)
+            "request": request,
+            "handle": flight,
+            "callback": lambda s, r: self.callback(flight, s, r)
         })
+        self.metrics.record_queue_depth(len(self.request_queue))
+
+        return handle
 
 
 ###----------------------------------------------------------------------------
@@ -343,20 +1508,42 @@ class NetworkThread(Thread):
     operations. All of the state is kept in this thread; requests are added in
     and callbacks are used to signal results out.
     """
-    def __init__(self, event, queue):
+    # The number of requests that are executed at the same time, which is also
+    # the number of HTTP objects in the transport pool.
+    workers = 1
+
+    def __init__(self, queue, index=None, metrics=None, dispatcher=None,
+                 login_expired=None):
         # log("== Creating network thread")
         super().__init__()
-        self.event = event
         self.requests = queue
+        self.index = index
+        self.metrics = metrics or NetworkMetrics()
+        self.dispatcher = dispatcher or ResultDispatcher(metrics=self.metrics)
+        self.limiter = RateLimiter()
+        self.quota = QuotaLedger(cache_file_path("YouTuberizer.quota.json"))
+        self.local = local()
         self.youtube = None
+        self.transport = None
+        self.video_cache = {}
+        self.snapshots = {}
+        self.snapshot_synced = {}
+        self.credentials = None
+        self.credentials_lock = Lock()
+        self.login_expired = login_expired
+        self.relogin_pending = False
+        self.token = None
+        self.refresh_timer = None
 
         # The requests that we know how to service, and what method invokes
         # them.
         self.request_map = {
             "authorize": self.authenticate,
             "deauthorize": self.deauthenticate,
+            "refresh_credentials": self.refresh,
             "uploads_playlist": self.uploads_playlist,
-            "playlist_contents": self.playlist_contents
+            "playlist_contents": self.playlist_contents,
+            "video_details": self.video_details
         }
 
     # def __del__(self):
@@ -366,9 +1553,35 @@ class NetworkThread(Thread):
         """
         Start the authorization flow. If the user has never authorized the app,
         this will launch a browser to ask them to do so and will return a
-        result as appropriate. Otherwise it will used cached credentials.
+        result as appropriate. Otherwise it will used cached credentials,
+        refreshing them first if required. If the request has interactive set
+        to False, it fails instead of launching the browser.
+
+        When the credentials are for the same login as the current service
+        object, that object is kept instead of being built again.
         """
-        self.youtube = get_authenticated_service()
+        self.relogin_pending = False
+        return self.login(request["interactive"] is not False)
+
+    def login(self, interactive):
+        """
+        Obtain credentials and set up the service object to use them; see
+        get_authorized_credentials() for what interactive means.
+        """
+        credentials = get_authorized_credentials(interactive)
+        if (self.youtube is not None and self.credentials is not None and
+                self.credentials.refresh_token == credentials.refresh_token):
+            self.credentials.token = credentials.token
+            self.credentials.expiry = credentials.expiry
+        else:
+            self.credentials = credentials
+            self.youtube = get_authenticated_service(self.credentials)
+            self.set_transport(HttpTransport(self.credentials, size=self.workers,
+                                             metrics=self.metrics))
+
+        self.token = self.credentials.token
+        self.schedule_refresh()
+
         return "Authenticated"
 
     def deauthenticate(self, request):
@@ -383,8 +1596,182 @@ class NetworkThread(Thread):
         except:
             pass
 
+        self.credentials = None
+        self.token = None
+        self.schedule_refresh()
+        self.set_transport(None)
+        self.video_cache = {}
+        self.snapshots = {}
+        if self.index is not None:
+            self.index.clear()
+
         return "Deauthenticated"
 
+    def set_transport(self, transport):
+        """
+        Set the transport that API requests are executed over, closing the
+        connections of the previous one, if any.
+        """
+        if self.transport is not None:
+            self.transport.close()
+
+        self.transport = transport
+
+    def execute(self, api_request):
+        """
+        Execute a request built from the service object and return the
+        response; see call_api().
+        """
+        method = getattr(api_request, "methodId", None) or "unknown"
+        return self.call_api(method, API_QUOTA_COSTS.get(method, 1),
+                             lambda http: api_request.execute(http=http))
+
+    def call_api(self, method, cost, call):
+        """
+        Make an API call to the given method, which costs the given number of
+        quota units; call is invoked with an HTTP object from the transport
+        pool and should make the call and return the result.
+
+        Calls are charged against the daily quota and rate limited, and calls
+        that fail with a transient error are retried after a delay.
+        """
+        background = getattr(self.local, "priority", PRIORITY_INTERACTIVE) >= PRIORITY_BACKGROUND
+        for attempt in count():
+            self.quota.charge(method, cost, background)
+            self.metrics.record_api_call(method)
+
+            delay = self.limiter.reserve(cost)
+            if delay and self.requests.sleep(delay):
+                raise RuntimeError("Network thread is shutting down")
+
+            try:
+                with self.transport.connection() as http:
+                    return call(http)
+
+            except Exception as err:
+                if attempt >= RETRY_LIMIT or not is_retryable_error(err):
+                    raise
+
+                delay = retry_delay(attempt)
+                log("{0} failed ({1}); retrying in {2:.1f}s", method, err, delay,
+                    level=LOG_WARNING)
+                if self.requests.sleep(delay):
+                    raise
+
+    def refresh(self, request):
+        """
+        Refresh the access token of the current credentials if it has expired
+        or is about to. This is requested in the background shortly before the
+        token expires, so that requests the user makes don't have to wait for
+        the refresh.
+        """
+        with self.credentials_lock:
+            if self.credentials is None:
+                return "Not authenticated"
+
+            if credentials_need_refresh(self.credentials):
+                if not refresh_credentials(self.credentials):
+                    raise ValueError("Unable to refresh access token; please log in again")
+
+                self.token = self.credentials.token
+
+            self.schedule_refresh()
+            return "Refreshed"
+
+    def schedule_refresh(self):
+        """
+        Schedule a background request to refresh the access token just before
+        it expires, replacing any previously scheduled refresh. Nothing is
+        scheduled if there are no credentials or their expiry is not known.
+        """
+        if self.refresh_timer is not None:
+            self.refresh_timer.cancel()
+            self.refresh_timer = None
+
+        if self.credentials is None or self.credentials.expiry is None:
+            return
+
+        expiry = self.credentials.expiry - TOKEN_REFRESH_MARGIN
+        delay = (expiry - datetime.datetime.utcnow()).total_seconds()
+
+        self.refresh_timer = Timer(max(delay, 0), self.queue_refresh)
+        self.refresh_timer.daemon = True
+        self.refresh_timer.start()
+
+    def queue_refresh(self):
+        """
+        Add a background request to refresh the access token to the queue.
+        This is invoked from the refresh timer thread.
+        """
+        def refreshed(success, result):
+            if not success:
+                log("Background token refresh failed: {0}", result, level=LOG_WARNING)
+
+        request = Request("refresh_credentials")
+        try:
+            self.requests.put({
+                "request": request,
+                "handle": RequestHandle(request, PRIORITY_BACKGROUND),
+                "callback": refreshed
+            })
+        except ValueError:
+            # The queue is closed, so we're shutting down.
+            pass
+
+    def ensure_fresh_credentials(self):
+        """
+        Make sure that the current access token is not about to expire before
+        making an API request, raising an exception if it can't be refreshed.
+
+        Logging in again replaces the transport that other workers may be
+        using and may need the browser, so it's never done here; an
+        interactive request that finds the token can't be refreshed instead
+        asks for the login_expired callback to be invoked in the main thread,
+        which should queue an authorize request. Requests fail until that has
+        been executed.
+
+        With the asyncio engine this runs in several workers at once, so the
+        refresh is done under a lock; workers that were waiting on it find the
+        token already fresh.
+        """
+        if self.credentials is None or not credentials_need_refresh(self.credentials):
+            return
+
+        with self.credentials_lock:
+            if self.credentials is None or not credentials_need_refresh(self.credentials):
+                return
+
+            if not self.relogin_pending:
+                if refresh_credentials(self.credentials):
+                    self.token = self.credentials.token
+                    self.schedule_refresh()
+                    return
+
+                priority = getattr(self.local, "priority", PRIORITY_INTERACTIVE)
+                if priority >= PRIORITY_BACKGROUND:
+                    raise ValueError("Unable to refresh access token; please log in again")
+
+                self.relogin_pending = True
+                if self.login_expired is not None:
+                    self.dispatcher.dispatch(self.login_expired)
+
+            raise ValueError("Your YouTube login has expired; logging in again")
+
+    def persist_credentials(self):
+        """
+        The transport used by the service object refreshes the access token on
+        its own if the API rejects it; when that happens, cache the new token
+        so that it's not lost.
+        """
+        if self.credentials is None or self.credentials.token == self.token:
+            return
+
+        with self.credentials_lock:
+            if self.credentials is not None and self.credentials.token != self.token:
+                cache_credentials(self.credentials)
+                self.token = self.credentials.token
+                self.schedule_refresh()
+
     def uploads_playlist(self, request):
         """
         YouTube stores the list of uploaded videos for a user in a specific
@@ -393,10 +1780,10 @@ class NetworkThread(Thread):
 
         This can return None if the user has not uploaded any videos.
         """
-        channels_response = self.youtube.channels().list(
+        channels_response = self.execute(self.youtube.channels().list(
             mine=True,
             part='contentDetails'
-        ).execute()
+        ))
 
         # From the API response, extract the playlist ID that identifies the
         # list of videos uploaded to the authenticated user's channel.
@@ -405,41 +1792,226 @@ class NetworkThread(Thread):
 
         return None
 
+    def snapshot_path(self, playlist_id):
+        """
+        Get the path of the file that the snapshot of the contents of the given
+        playlist is stored in.
+        """
+        return cache_file_path("YouTuberizer.playlist.%s.json" % playlist_id)
+
+    def load_snapshot(self, playlist_id):
+        """
+        Get the snapshot of the contents of the given playlist from the last
+        time it was fetched. This is a list of dictionaries with the video_id,
+        title, description and published date of each video, in playlist order.
+        An empty list is returned if there is no snapshot (or it's not usable).
+
+        The time of the last full fetch the snapshot came from is recorded in
+        snapshot_synced.
+        """
+        if playlist_id not in self.snapshots:
+            items = []
+            synced = 0
+            try:
+                with open(self.snapshot_path(playlist_id), "r", encoding="utf-8") as handle:
+                    snapshot = json.load(handle)
+
+                if (snapshot["version"] == _SNAPSHOT_VERSION and
+                        snapshot["playlist_id"] == playlist_id):
+                    items = snapshot["items"]
+                    synced = snapshot.get("synced", 0)
+
+            except (OSError, ValueError, KeyError, TypeError):
+                pass
+
+            self.snapshots[playlist_id] = items
+            self.snapshot_synced[playlist_id] = synced
+
+        return self.snapshots[playlist_id]
+
+    def save_snapshot(self, playlist_id, items, synced):
+        """
+        Store a new snapshot of the contents of the given playlist, along with
+        the time of the last full fetch that it came from.
+        """
+        self.snapshots[playlist_id] = items
+        self.snapshot_synced[playlist_id] = synced
+        write_json_file(self.snapshot_path(playlist_id), {
+            "version": _SNAPSHOT_VERSION,
+            "playlist_id": playlist_id,
+            "synced": synced,
+            "items": items
+        })
+
     def playlist_contents(self, request):
         """
         Given the ID of a playlsit for a user, fetch the contents of that
         playlist.
+
+        When the request is incremental, pages are only fetched until we find
+        a video that was in the snapshot from the last time the playlist was
+        fetched, and the new videos are merged into that snapshot. This relies
+        on the playlist being ordered newest first (as the uploads playlist
+        is); removed videos and changed titles are only picked up by a full
+        fetch, which replaces the snapshot entirely. For that reason, an
+        incremental request makes a full fetch anyway when the last one was
+        more than SNAPSHOT_MAX_AGE ago.
         """
+        playlist_id = request["playlist_id"]
+        snapshot = self.load_snapshot(playlist_id) if request["incremental"] else []
+        synced = self.snapshot_synced.get(playlist_id, 0)
+        if time.time() - synced >= SNAPSHOT_MAX_AGE:
+            snapshot = []
+
+        full = not snapshot
+        if full:
+            synced = time.time()
+
+        known = {item["video_id"] for item in snapshot}
+
         playlistitems_list_request = self.youtube.playlistItems().list(
-            playlistId=request["playlist_id"],
+            playlistId=playlist_id,
             part='snippet',
-            # maxResults=20
+            maxResults=PLAYLIST_PAGE_SIZE,
+            fields=PLAYLIST_FIELDS
         )
 
-        results = []
+        items = []
         while playlistitems_list_request:
-            playlistitems_list_response = playlistitems_list_request.execute()
-
-            # Print information about each video.
-            for playlist_item in playlistitems_list_response['items']:
-                title = playlist_item['snippet']['title']
-                video_id = playlist_item['snippet']['resourceId']['videoId']
-                results.append([title, 'https://youtu.be/%s' % video_id])
+            playlistitems_list_response = self.execute(playlistitems_list_request)
+
+            found_known = False
+            for playlist_item in playlistitems_list_response.get('items', []):
+                snippet = playlist_item['snippet']
+                video_id = snippet['resourceId']['videoId']
+                if video_id in known:
+                    found_known = True
+                    break
+
+                items.append({
+                    "video_id": video_id,
+                    "title": snippet['title'],
+                    "description": snippet.get('description', ''),
+                    "published": snippet.get('publishedAt')
+                })
+
+            if found_known:
+                break
 
             playlistitems_list_request = self.youtube.playlistItems().list_next(
                 playlistitems_list_request, playlistitems_list_response)
 
+        if items or full:
+            snapshot = items + snapshot
+            self.save_snapshot(playlist_id, snapshot, synced)
+
+        # Index the new videos, and the whole snapshot if the index is missing
+        # some of it (e.g. it was created after the snapshot was). A full
+        # fetch also drops videos that are no longer in the playlist.
+        if self.index is not None:
+            self.index.update(items)
+            if full:
+                self.index.prune([item["video_id"] for item in snapshot])
+            elif self.index.count() < len(snapshot):
+                self.index.update(snapshot)
+
+        results = [[item["title"], 'https://youtu.be/%s' % item["video_id"]]
+                   for item in snapshot]
+
         return list(sorted(results))
 
+    def video_details(self, request):
+        """
+        Given a list of video ID's, fetch the details of those videos, which
+        includes things like the tags, duration, view count and privacy status.
+
+        The result is a dictionary keyed by video ID; videos that don't exist
+        are not included. Details are cached, so only videos we have not seen
+        before are fetched unless the request asks to refetch them.
+
+        The ID's are looked up API_MAX_IDS at a time, and those lookups are
+        sent BATCH_MAX_REQUESTS at a time in a single batch HTTP request.
+        """
+        video_ids = request["video_ids"] or []
+        if request["refetch"]:
+            missing = list(video_ids)
+        else:
+            missing = [v for v in video_ids if v not in self.video_cache]
+
+        # Remove duplicates but keep the order
+        missing = list(dict.fromkeys(missing))
+
+        lookups = [missing[i:i + API_MAX_IDS] for i in range(0, len(missing), API_MAX_IDS)]
+
+        def execute_batch(http, group):
+            errors = []
+
+            def add_videos(request_id, response, exception):
+                if exception is not None:
+                    errors.append(exception)
+                else:
+                    for video in response["items"]:
+                        self.video_cache[video["id"]] = video
+
+            batch = self.youtube.new_batch_http_request(callback=add_videos)
+            for ids in group:
+                batch.add(self.youtube.videos().list(
+                    id=",".join(ids),
+                    part=VIDEO_DETAIL_PARTS,
+                    maxResults=API_MAX_IDS
+                ))
+
+            batch.execute(http=http)
+            if errors:
+                raise errors[0]
+
+        for idx in range(0, len(lookups), BATCH_MAX_REQUESTS):
+            group = lookups[idx:idx + BATCH_MAX_REQUESTS]
+            self.call_api("youtube.videos.list", len(group),
+                          lambda http: execute_batch(http, group))
+
+        if self.index is not None:
+            self.index.update([{
+                "video_id": video["id"],
+                "title": video["snippet"]["title"],
+                "description": video["snippet"].get("description", ""),
+                "tags": video["snippet"].get("tags", []),
+                "published": video["snippet"].get("publishedAt")
+            } for video in (self.video_cache[v] for v in missing if v in self.video_cache)])
+
+            # Deleted and private videos are not returned at all; remember
+            # that so that they're not asked for again.
+            self.index.mark_unavailable([v for v in missing if v not in self.video_cache])
+
+        return {v: self.video_cache[v] for v in video_ids if v in self.video_cache}
+
 
     def handle_request(self, request_obj):
         """
         Handle the asked for request, dispatching an appropriate callback when
         the request is complete (depending on whether it worked or not).
         """
-        request = request_obj["request"]
+        success, result = self.process_request(request_obj)
+        self.deliver(request_obj, success, result)
+
+    def deliver(self, request_obj, success, result):
+        """
+        Deliver the result of a request to its callback in the main thread.
+        """
         callback = request_obj["callback"]
+        self.dispatcher.dispatch(lambda: callback(success, result))
+
+    def process_request(self, request_obj):
+        """
+        Execute the asked for request, returning a tuple of a boolean that
+        indicates whether it worked and either the result or the reason it
+        failed.
+        """
+        request = request_obj["request"]
+        handle = request_obj["handle"]
+        self.local.priority = handle.priority
 
+        started = time.monotonic()
         success = True
         result = None
 
@@ -448,36 +2020,174 @@ class NetworkThread(Thread):
             if handler is None:
                 raise ValueError("Unknown request '%s'" % request.name)
 
+            if request.name not in ("authorize", "deauthorize", "refresh_credentials"):
+                self.ensure_fresh_credentials()
+
             success = True
             result = handler(request)
+            self.persist_credentials()
 
         except Exception as err:
             success = False
             result = str(err)
 
-        sublime.set_timeout(lambda: callback(success, result))
-        self.requests.task_done()
+        self.metrics.record_request(request.name, started - handle.submitted,
+                                    time.monotonic() - started, success)
+        self.metrics.record_queue_depth(len(self.requests))
+
+        return success, result
 
     def run(self):
         """
-        The main loop needs to loop until a semaphore tells it that it's time
-        to quit, at which point it will drop out of the loop and gracefully
-        exit, perhaps telling all connections to close in response.
+        The main loop services requests from the queue in priority order until
+        the queue is closed, at which point it will drop out of the loop and
+        gracefully exit.
 
-        This needs to select all connections for reading, only those that have
-        data pending send for writing, and needs to safely busy loop when there
-        are no connections.
+        While there are no requests the thread sleeps in the queue; closing the
+        queue wakes it up immediately.
         """
         # log("== Entering network loop")
-        while not self.event.is_set():
+        while True:
+            request = self.requests.get()
+            if request is None:
+                break
+
+            self.handle_request(request)
+
+        self.cleanup()
+
+    def cleanup(self):
+        """
+        Clean up the state of the thread as it terminates.
+        """
+        if self.refresh_timer is not None:
+            self.refresh_timer.cancel()
+
+        self.set_transport(None)
+        self.quota.save()
+        log("Network thread has terminated", level=LOG_DEBUG)
+
+
+###----------------------------------------------------------------------------
+
+
+class AsyncNetworkThread(NetworkThread):
+    """
+    An alternative to NetworkThread that runs an asyncio event loop in the
+    background thread and executes several requests at once. The API client
+    calls block, so they are executed in a pool of worker threads; the event
+    loop tracks them, applies timeouts and hands results back to the main
+    thread.
+
+    Requests are still taken from the queue in priority order, but only when a
+    worker is free to execute them. Requests that change the login state are
+    executed on their own, once everything in flight has finished.
+    """
+    # Requests that must not run at the same time as any other request.
+    exclusive_requests = ("authorize", "deauthorize", "refresh_credentials")
+
+    def __init__(self, queue, index=None, metrics=None, dispatcher=None,
+                 workers=4, timeout=None, login_expired=None):
+        super().__init__(queue, index, metrics, dispatcher, login_expired)
+        self.workers = workers
+        self.timeout = timeout
+        self.slots = Semaphore(workers)
+        self.loop = None
+        self.executor = None
+
+    @staticmethod
+    def available():
+        """
+        Returns an indication of whether this engine can be used at all;
+        asyncio is not available in the version of Python that older builds
+        of Sublime use.
+        """
+        try:
+            import asyncio
+            return True
+        except ImportError:
+            return False
+
+    def feed(self):
+        """
+        Take requests from the queue as workers become free, handing them to
+        the event loop to be started; this runs in its own thread, since
+        taking from the queue blocks. When the queue is closed, the event loop
+        is stopped.
+        """
+        while True:
+            self.slots.acquire()
+            request_obj = self.requests.get()
+            if request_obj is None:
+                break
+
+            # An exclusive request needs every worker to be free.
+            slots = 1
+            if request_obj["request"].name in self.exclusive_requests:
+                for _ in range(self.workers - 1):
+                    self.slots.acquire()
+                slots = self.workers
+
+            self.loop.call_soon_threadsafe(self.start_request, request_obj, slots)
+
+        self.loop.call_soon_threadsafe(self.loop.stop)
+
+    def start_request(self, request_obj, slots):
+        """
+        Start executing a request in the worker pool; this is invoked in the
+        event loop. If the request has a timeout and it expires, a failure is
+        delivered right away and the eventual result is discarded.
+        """
+        def work():
             try:
-                request = self.requests.get(block=True, timeout=0.25)
-                self.handle_request(request)
+                return self.process_request(request_obj)
+            finally:
+                for _ in range(slots):
+                    self.slots.release()
 
-            except queue.Empty:
-                pass
+        future = self.loop.run_in_executor(self.executor, work)
+
+        timer = None
+        if self.timeout and slots == 1:
+            timer = self.loop.call_later(self.timeout, future.cancel)
+
+        def finished(future):
+            if timer is not None:
+                timer.cancel()
+
+            if future.cancelled():
+                self.deliver(request_obj, False, "Request timed out after %ds" % self.timeout)
+            elif future.exception() is not None:
+                self.deliver(request_obj, False, str(future.exception()))
+            else:
+                self.deliver(request_obj, *future.result())
+
+        future.add_done_callback(finished)
+
+    def run(self):
+        """
+        Run the event loop until the queue is closed.
+        """
+        # These are only imported when this engine is used, to keep them out
+        # of the time it takes to load the plugin.
+        import asyncio
+        from concurrent.futures import ThreadPoolExecutor
+
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.executor = ThreadPoolExecutor(max_workers=self.workers)
+
+        feeder = Thread(target=self.feed)
+        feeder.daemon = True
+        feeder.start()
+
+        try:
+            self.loop.run_forever()
+        finally:
+            self.executor.shutdown(wait=False)
+            self.loop.close()
 
-        log("Network thread has terminated")
+        self.cleanup()
 
 
 ###----------------------------------------------------------------------------
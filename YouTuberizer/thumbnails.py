@@ -0,0 +1,249 @@
+import os
+import time
+import base64
+from collections import OrderedDict
+from threading import Lock, get_ident
+
+
+###----------------------------------------------------------------------------
+
+
+# The URL that the thumbnail of a video is fetched from; the medium quality
+# thumbnail is 320x180, which is a good size for a popup.
+THUMBNAIL_URL = "https://i.ytimg.com/vi/{video_id}/mqdefault.jpg"
+
+# The timeout (in seconds) for fetching a thumbnail.
+THUMBNAIL_TIMEOUT = 10
+
+# How long (in seconds) to wait before trying again to fetch a thumbnail that
+# could not be fetched; videos that are private or deleted have none.
+THUMBNAIL_RETRY = 10 * 60
+
+
+###----------------------------------------------------------------------------
+
+
+def thumbnail_html(encoded):
+    """
+    Return a minihtml image tag for a base64 encoded thumbnail.
+    """
+    return '<img src="data:image/jpeg;base64,%s" width="320" height="180">' % encoded
+
+
+###----------------------------------------------------------------------------
+
+
+class ThumbnailCache():
+    """
+    Fetch and cache the thumbnails of videos so that they can be displayed in
+    popups and phantoms.
+
+    Thumbnails are fetched by a bounded pool of threads and stored in a folder
+    that is capped in size, evicting the least recently used thumbnails when
+    it grows too large. The most recently used thumbnails are also kept in
+    memory as base64 data, ready to be put into minihtml. Thumbnails that
+    could not be fetched are not asked for again for THUMBNAIL_RETRY seconds.
+
+    The lock only guards the bookkeeping; the disk and the network are never
+    touched while it's held, so the main thread never waits on either.
+
+    Callbacks are invoked via the deliver function, which is expected to run
+    them in the main thread; failures are reported via the warn function,
+    which takes a format string and its arguments.
+    """
+    def __init__(self, path, deliver, warn, workers=4, max_bytes=32 * 1024 * 1024,
+                 memory_items=64):
+        self.path = path
+        self.deliver = deliver
+        self.warn = warn
+        self.workers = workers
+        self.max_bytes = max_bytes
+        self.memory_items = memory_items
+        self.lock = Lock()
+        self.executor = None
+        self.files = None
+        self.total_bytes = 0
+        self.memory = OrderedDict()
+        self.pending = {}
+        self.failed = {}
+
+    def file_path(self, video_id):
+        return os.path.join(self.path, "%s.jpg" % video_id)
+
+    def scan(self):
+        """
+        Find the thumbnails that are already on disk, in the order that they
+        were last used; this only happens the first time it's invoked.
+        """
+        with self.lock:
+            if self.files is not None:
+                return
+
+        os.makedirs(self.path, exist_ok=True)
+
+        entries = []
+        for entry in os.listdir(self.path):
+            name, ext = os.path.splitext(entry)
+            if ext == ".jpg":
+                stat = os.stat(os.path.join(self.path, entry))
+                entries.append((stat.st_mtime, name, stat.st_size))
+
+        with self.lock:
+            if self.files is not None:
+                return
+
+            self.files = OrderedDict()
+            self.total_bytes = 0
+            for mtime, video_id, size in sorted(entries):
+                self.files[video_id] = size
+                self.total_bytes += size
+
+    def store(self, video_id, data):
+        """
+        Write a thumbnail to disk, evicting the least recently used ones if
+        the cache is now over its size limit.
+        """
+        path = self.file_path(video_id)
+        temp_path = "%s.%d.tmp" % (path, get_ident())
+        with open(temp_path, "wb") as handle:
+            handle.write(data)
+        os.replace(temp_path, path)
+
+        with self.lock:
+            self.total_bytes += len(data) - self.files.pop(video_id, 0)
+            self.files[video_id] = len(data)
+
+            evicted = []
+            while self.total_bytes > self.max_bytes and len(self.files) > 1:
+                oldest, size = self.files.popitem(last=False)
+                self.total_bytes -= size
+                evicted.append(oldest)
+
+        for oldest in evicted:
+            try:
+                os.remove(self.file_path(oldest))
+            except OSError:
+                pass
+
+    def remember(self, video_id, data):
+        """
+        Add a thumbnail to the in memory cache, returning its base64 encoded
+        form.
+        """
+        encoded = base64.b64encode(data).decode("ascii")
+        with self.lock:
+            self.memory[video_id] = encoded
+            while len(self.memory) > self.memory_items:
+                self.memory.popitem(last=False)
+
+        return encoded
+
+    def get(self, video_id):
+        """
+        Return the base64 encoded thumbnail of the given video if it has been
+        cached, or None if it has to be fetched first. This only reads from
+        the disk and never makes a request.
+        """
+        with self.lock:
+            if video_id in self.memory:
+                self.memory.move_to_end(video_id)
+                return self.memory[video_id]
+
+        self.scan()
+        with self.lock:
+            if video_id not in self.files:
+                return None
+
+        path = self.file_path(video_id)
+        try:
+            with open(path, "rb") as handle:
+                data = handle.read()
+            os.utime(path)
+        except OSError:
+            with self.lock:
+                self.total_bytes -= self.files.pop(video_id, 0)
+            return None
+
+        with self.lock:
+            if video_id in self.files:
+                self.files.move_to_end(video_id)
+
+        return self.remember(video_id, data)
+
+    def fetch(self, video_ids, callback=None):
+        """
+        Make sure that the thumbnails of the given videos are cached, loading
+        or fetching any that are not in memory in the background. The callback
+        is invoked with the video ID and the base64 encoded thumbnail (or None
+        if the fetch failed) for each video, as soon as its thumbnail is
+        available.
+        """
+        now = time.time()
+        for video_id in video_ids:
+            with self.lock:
+                encoded = self.memory.get(video_id)
+                if encoded is not None:
+                    self.memory.move_to_end(video_id)
+                elif now - self.failed.get(video_id, 0) < THUMBNAIL_RETRY:
+                    pass
+                elif video_id in self.pending:
+                    if callback is not None:
+                        self.pending[video_id].append(callback)
+                    continue
+                else:
+                    self.pending[video_id] = [callback] if callback else []
+                    if self.executor is None:
+                        from concurrent.futures import ThreadPoolExecutor
+                        self.executor = ThreadPoolExecutor(self.workers)
+                    self.executor.submit(self.load, video_id)
+                    continue
+
+            if callback is not None:
+                self.deliver(lambda v=video_id, e=encoded: callback(v, e))
+
+    def load(self, video_id):
+        """
+        Load the thumbnail of a video from disk, fetching it if it's not there,
+        then let everyone that was waiting for it know; this is invoked in the
+        thread pool.
+        """
+        encoded = None
+        try:
+            encoded = self.get(video_id) or self.download(video_id)
+        except Exception as err:
+            self.warn("Unable to fetch thumbnail for {0}: {1}", video_id, err)
+
+        with self.lock:
+            if encoded is None:
+                self.failed[video_id] = time.time()
+            else:
+                self.failed.pop(video_id, None)
+            callbacks = self.pending.pop(video_id, [])
+
+        for callback in callbacks:
+            self.deliver(lambda c=callback: c(video_id, encoded))
+
+    def download(self, video_id):
+        """
+        Fetch the thumbnail of a video and cache it, returning its base64
+        encoded form.
+        """
+        from urllib.request import urlopen
+
+        url = THUMBNAIL_URL.format(video_id=video_id)
+        with urlopen(url, timeout=THUMBNAIL_TIMEOUT) as response:
+            data = response.read()
+
+        self.store(video_id, data)
+        return self.remember(video_id, data)
+
+    def shutdown(self):
+        """
+        Stop the thread pool; thumbnails that have not started downloading
+        yet are abandoned.
+        """
+        with self.lock:
+            executor, self.executor = self.executor, None
+
+        if executor is not None:
+            executor.shutdown(wait=False)
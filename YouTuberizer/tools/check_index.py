@@ -0,0 +1,94 @@
+"""
+Check that searches of the local video index behave the same no matter which
+full text search module the index ends up using.
+
+The index prefers fts5, falls back to fts4 on older builds of SQLite and to
+plain LIKE queries when neither is available, and each of those has its own
+query syntax. This builds a small index with each of them in turn and runs the
+same searches against all of them.
+
+Usage: python check_index.py
+"""
+import os
+import sys
+import shutil
+import tempfile
+
+
+###----------------------------------------------------------------------------
+
+
+_tools = os.path.dirname(os.path.abspath(__file__))
+_root = os.path.dirname(os.path.dirname(_tools))
+
+# The videos that are put into the index.
+_videos = [
+    {"video_id": "vid1", "title": "Hello world", "description": "A first video",
+     "tags": ["intro"], "published": "2020-01-01T00:00:00Z"},
+    {"video_id": "vid2", "title": "Sublime Text plugins", "description": "Writing plugins",
+     "tags": ["python", "sublime"], "published": "2020-02-01T00:00:00Z"},
+    {"video_id": "vid3", "title": "Helpful tips", "description": "Odds and ends",
+     "tags": [], "published": "2020-03-01T00:00:00Z"},
+]
+
+# The searches to run, and the video ID's that each should find.
+_searches = [
+    ("hello", {"vid1"}),
+    ("hel", {"vid1", "vid3"}),
+    ("hel wor", {"vid1"}),
+    ("plug", {"vid2"}),
+    ("pyth", {"vid2"}),
+    ("sublime plugins", {"vid2"}),
+    ("missing", set()),
+]
+
+
+###----------------------------------------------------------------------------
+
+
+def check(modules, folder):
+    """
+    Build an index that can only use the given full text search modules and
+    run all of the searches against it, returning the module that was used
+    and the number of searches that failed.
+    """
+    from YouTuberizer import video_index
+
+    video_index._FTS_MODULES = modules
+    index = video_index.VideoIndex(os.path.join(folder, "%s.sqlite" % "-".join(modules or ["like"])))
+    index.update(_videos)
+
+    failures = 0
+    for query, expected in _searches:
+        found = {url.rsplit("/", 1)[1] for title, url in index.search(query)}
+        if found != expected:
+            failures += 1
+            print("  %-20s expected %s, found %s" % (repr(query), sorted(expected), sorted(found)))
+
+    module = index.fts or "like"
+    index.close()
+    return module, failures
+
+
+def main():
+    sys.path.insert(0, _root)
+
+    folder = tempfile.mkdtemp()
+    failed = False
+    try:
+        for modules in (["fts5"], ["fts4"], []):
+            module, failures = check(modules, folder)
+            if modules and module != modules[0]:
+                print("%-6s not available in this build of SQLite" % modules[0])
+                continue
+
+            print("%-6s %d of %d searches failed" % (module, failures, len(_searches)))
+            failed = failed or failures > 0
+    finally:
+        shutil.rmtree(folder)
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,278 @@
+"""
+A local stand in for the parts of the YouTube Data API that the network layer
+uses, so that it can be exercised without a Google account or a network
+connection.
+
+The server provides the discovery document for the API (rewritten so that all
+requests come back to this server), as well as channels.list, which returns a
+single channel with an uploads playlist, and playlistItems.list, which pages
+through a configurable number of videos in that playlist, newest first.
+
+The latency of responses, the rate of server errors and the daily quota can
+all be configured; exceeding the quota returns the same 403 error the real API
+does. Authorization headers are accepted but not checked.
+
+Usage: python fake_youtube.py [--port PORT] [--videos COUNT] [--latency MS] ...
+"""
+import json
+import time
+import random
+import argparse
+import threading
+import urllib.request
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from socketserver import ThreadingMixIn
+from urllib.parse import urlparse, parse_qs
+
+
+###----------------------------------------------------------------------------
+
+
+# The ID of the uploads playlist of the fake channel.
+UPLOADS_PLAYLIST = "UUfakeUploadsPlaylist"
+
+# Where the real discovery document is fetched from when the installed client
+# library doesn't bundle a copy of it.
+DISCOVERY_URI = "https://www.googleapis.com/discovery/v1/apis/youtube/v3/rest"
+
+
+###----------------------------------------------------------------------------
+
+
+def load_discovery_document():
+    """
+    Load the YouTube discovery document, preferring the copy bundled with the
+    client library (version 2.0 and later) so that no network is needed.
+    """
+    try:
+        from googleapiclient.discovery_cache import get_static_doc
+        document = get_static_doc("youtube", "v3")
+        if document:
+            return json.loads(document)
+    except ImportError:
+        pass
+
+    with urllib.request.urlopen(DISCOVERY_URI) as response:
+        return json.loads(response.read().decode("utf-8"))
+
+
+class FakeYouTube():
+    """
+    The state of the fake API: the videos in the channel and the quota that
+    has been used so far, along with the behaviour settings.
+    """
+    def __init__(self, videos=10000, latency=0, jitter=0, error_rate=0.0,
+                 quota=None, page_limit=50):
+        self.videos = ["fakeVideo%06d" % n for n in range(videos, 0, -1)]
+        self.latency = latency / 1000.0
+        self.jitter = jitter / 1000.0
+        self.error_rate = error_rate
+        self.quota = quota
+        self.page_limit = page_limit
+        self.lock = threading.Lock()
+        self.used = 0
+        self.calls = {}
+        self.document = None
+
+    def add_videos(self, count):
+        """
+        Add new videos to the front of the uploads playlist, as if they were
+        just uploaded.
+        """
+        with self.lock:
+            start = len(self.videos) + 1
+            self.videos[:0] = ["fakeVideo%06d" % n for n in range(start + count - 1, start - 1, -1)]
+
+    def discovery(self, root):
+        if self.document is None:
+            self.document = load_discovery_document()
+
+        document = dict(self.document)
+        document["rootUrl"] = root
+        document["baseUrl"] = root + document.get("servicePath", "")
+        document["mtlsRootUrl"] = root
+        return document
+
+    def charge(self, method):
+        """
+        Charge a call to the given method against the quota, returning False
+        if there is no quota left.
+        """
+        with self.lock:
+            self.calls[method] = self.calls.get(method, 0) + 1
+            if self.quota is not None and self.used >= self.quota:
+                return False
+
+            self.used += 1
+            return True
+
+    def channels(self, query):
+        return {
+            "kind": "youtube#channelListResponse",
+            "items": [{
+                "kind": "youtube#channel",
+                "id": "UCfakeChannel",
+                "contentDetails": {"relatedPlaylists": {"uploads": UPLOADS_PLAYLIST}}
+            }]
+        }
+
+    def playlist_items(self, query):
+        if query.get("playlistId") != UPLOADS_PLAYLIST:
+            return None
+
+        size = min(int(query.get("maxResults", 5)), self.page_limit)
+        start = int(query.get("pageToken", 0))
+        with self.lock:
+            page = self.videos[start:start + size]
+            more = start + size < len(self.videos)
+
+        response = {
+            "kind": "youtube#playlistItemListResponse",
+            "pageInfo": {"totalResults": len(self.videos), "resultsPerPage": size},
+            "items": [{
+                "snippet": {
+                    "title": "Fake video %s" % video_id[9:],
+                    "description": "The description of fake video %s" % video_id[9:],
+                    "publishedAt": "2019-12-01T00:00:00Z",
+                    "resourceId": {"kind": "youtube#video", "videoId": video_id}
+                }
+            } for video_id in page]
+        }
+        if more:
+            response["nextPageToken"] = str(start + size)
+
+        return response
+
+
+###----------------------------------------------------------------------------
+
+
+def make_handler(api):
+    """
+    Create a request handler class that serves the given FakeYouTube.
+    """
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        # Headers and body are written separately; without this, keep-alive
+        # connections stall on the interaction of Nagle and delayed ACKs.
+        disable_nagle_algorithm = True
+
+        def send_json(self, status, body):
+            data = json.dumps(body).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json; charset=UTF-8")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def send_error_json(self, status, reason, message):
+            self.send_json(status, {"error": {
+                "code": status,
+                "message": message,
+                "errors": [{"reason": reason, "message": message}]
+            }})
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            query = {k: v[0] for k, v in parse_qs(url.query).items()}
+            root = "http://%s:%d/" % self.server.server_address[:2]
+
+            if url.path.startswith("/discovery/"):
+                return self.send_json(200, api.discovery(root))
+
+            endpoints = {
+                "/youtube/v3/channels": ("channels.list", api.channels),
+                "/youtube/v3/playlistItems": ("playlistItems.list", api.playlist_items),
+            }
+            if url.path not in endpoints:
+                return self.send_error_json(404, "notFound", "Unknown endpoint")
+
+            method, handler = endpoints[url.path]
+            if api.latency or api.jitter:
+                time.sleep(api.latency + random.uniform(0, api.jitter))
+
+            if not api.charge(method):
+                return self.send_error_json(403, "quotaExceeded",
+                    "The request cannot be completed because you have exceeded your quota.")
+
+            if random.random() < api.error_rate:
+                return self.send_error_json(503, "backendError", "Backend Error")
+
+            response = handler(query)
+            if response is None:
+                return self.send_error_json(404, "playlistNotFound", "Playlist not found")
+
+            self.send_json(200, response)
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+class FakeYouTubeServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, api, port=0):
+        super().__init__(("127.0.0.1", port), make_handler(api))
+        self.api = api
+
+    @property
+    def root(self):
+        return "http://%s:%d/" % self.server_address[:2]
+
+    @property
+    def discovery_uri(self):
+        return self.root + "discovery/v1/apis/{api}/{version}/rest"
+
+    def start(self):
+        """
+        Start serving requests in a background thread.
+        """
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return self
+
+
+###----------------------------------------------------------------------------
+
+
+def add_arguments(parser):
+    parser.add_argument("--videos", type=int, default=10000,
+                        help="number of videos in the uploads playlist")
+    parser.add_argument("--latency", type=float, default=0,
+                        help="latency added to every API response, in ms")
+    parser.add_argument("--jitter", type=float, default=0,
+                        help="random extra latency of up to this many ms")
+    parser.add_argument("--error-rate", type=float, default=0.0,
+                        help="fraction of API calls that fail with a 503")
+    parser.add_argument("--quota", type=int, default=None,
+                        help="number of API calls allowed before quotaExceeded")
+    parser.add_argument("--page-limit", type=int, default=50,
+                        help="largest page size that is honoured")
+
+
+def make_api(args):
+    return FakeYouTube(args.videos, args.latency, args.jitter, args.error_rate,
+                       args.quota, args.page_limit)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--port", type=int, default=8080)
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    server = FakeYouTubeServer(make_api(args), args.port)
+    print("Serving fake YouTube API at %s" % server.root)
+    print("Discovery URI: %s" % server.discovery_uri)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,177 @@
+"""
+Drive the YouTuberizer network layer headlessly against the fake YouTube API
+server in fake_youtube.py, measuring throughput and latency.
+
+The plugin is loaded with the stub sublime module from the stubs folder, a set
+of fake credentials is cached so that no login is needed, and the discovery
+document is pointed at the fake server. Each iteration submits a number of
+playlist_contents requests for the uploads playlist at once and waits for all
+of them to be delivered; latency is measured from submission to delivery in
+the (emulated) main thread.
+
+Usage: python load_test.py [--videos COUNT] [--iterations N] [--concurrency N] ...
+"""
+import os
+import sys
+import time
+import argparse
+import datetime
+
+from fake_youtube import FakeYouTubeServer, add_arguments, make_api
+
+
+###----------------------------------------------------------------------------
+
+
+_tools = os.path.dirname(os.path.abspath(__file__))
+_root = os.path.dirname(os.path.dirname(_tools))
+
+
+###----------------------------------------------------------------------------
+
+
+def percentile(samples, percent):
+    """
+    Return the given percentile of a list of samples.
+    """
+    ordered = sorted(samples)
+    idx = min(len(ordered) - 1, int(round(len(ordered) * percent / 100.0 + 0.5)) - 1)
+    return ordered[max(0, idx)]
+
+
+def run_requests(sublime, manager, requests, refresh=False, timeout=600):
+    """
+    Submit all of the given requests to the manager at once and wait until all
+    of them have been delivered; the result is a list of (latency, success,
+    result) tuples in the order the requests were given.
+    """
+    results = [None] * len(requests)
+
+    def submit(idx, request):
+        started = time.perf_counter()
+        def delivered(request, success, result):
+            results[idx] = (time.perf_counter() - started, success, result)
+
+        manager.request(request, delivered, refresh=refresh)
+
+    for idx, request in enumerate(requests):
+        submit(idx, request)
+
+    deadline = time.time() + timeout
+    while None in results:
+        if time.time() > deadline:
+            raise RuntimeError("Timed out waiting for requests to complete")
+
+        if not sublime.pump():
+            time.sleep(0.001)
+
+    return results
+
+
+def setup(args, server):
+    """
+    Load the network layer with the stub sublime module, configure it to talk
+    to the fake server and return the modules along with a new manager.
+    """
+    sys.path[:0] = [os.path.join(_tools, "stubs"), _root]
+
+    import sublime
+    import google.oauth2.credentials
+    from YouTuberizer import networking
+
+    networking.DISCOVERY_URI = server.discovery_uri
+    networking.RETRY_BASE_DELAY = args.retry_delay
+
+    config = networking.CLIENT_CONFIG["installed"]
+    credentials = google.oauth2.credentials.Credentials(
+        "fake-access-token", "fake-refresh-token", None, config["token_uri"],
+        config["client_id"], config["client_secret"], networking.SCOPES)
+    credentials.expiry = datetime.datetime.utcnow() + datetime.timedelta(days=1)
+    networking.cache_credentials(credentials)
+
+    manager = networking.NetworkManager(engine=args.engine, workers=args.workers,
+                                        timeout=args.timeout)
+    if args.no_rate_limit:
+        manager.net_thread.limiter = networking.RateLimiter(rate=1e9, capacity=1e9)
+
+    return sublime, networking, manager
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    add_arguments(parser)
+    parser.add_argument("--iterations", type=int, default=5,
+                        help="number of rounds of requests to make")
+    parser.add_argument("--concurrency", type=int, default=1,
+                        help="number of requests submitted at once per round")
+    parser.add_argument("--incremental", action="store_true",
+                        help="make incremental requests, adding --new-videos per round")
+    parser.add_argument("--new-videos", type=int, default=5,
+                        help="videos uploaded between rounds in incremental mode")
+    parser.add_argument("--retry-delay", type=float, default=0.05,
+                        help="base delay for retries, in seconds")
+    parser.add_argument("--no-rate-limit", action="store_true",
+                        help="disable the client side rate limiter")
+    parser.add_argument("--engine", choices=["thread", "asyncio"], default="thread",
+                        help="the network engine to use")
+    parser.add_argument("--workers", type=int, default=4,
+                        help="number of workers for the asyncio engine")
+    parser.add_argument("--timeout", type=float, default=None,
+                        help="request timeout in seconds for the asyncio engine")
+    args = parser.parse_args()
+
+    server = FakeYouTubeServer(make_api(args)).start()
+    sublime, networking, manager = setup(args, server)
+    from YouTuberizer.metrics import format_report
+
+    try:
+        Request = networking.Request
+        run_requests(sublime, manager, [Request("authorize")])
+        latency, success, playlist = run_requests(sublime, manager,
+                                                  [Request("uploads_playlist")])[0]
+        if not success:
+            raise RuntimeError("Unable to get uploads playlist: %s" % playlist)
+
+        samples = []
+        failures = 0
+        videos = 0
+        started = time.perf_counter()
+        for iteration in range(args.iterations):
+            if args.incremental and iteration:
+                server.api.add_videos(args.new_videos)
+
+            request = Request("playlist_contents", playlist_id=playlist,
+                              incremental=args.incremental)
+            for latency, success, result in run_requests(
+                    sublime, manager, [request] * args.concurrency, refresh=True):
+                samples.append(latency)
+                if success:
+                    videos = len(result)
+                else:
+                    failures += 1
+                    print("Request failed: %s" % result)
+
+        elapsed = time.perf_counter() - started
+
+    finally:
+        manager.shutdown()
+        server.shutdown()
+
+    print()
+    print("Engine:             %s" % type(manager.net_thread).__name__)
+    print("Videos in channel:  %d" % len(server.api.videos))
+    print("Videos returned:    %d" % videos)
+    print("Requests:           %d (%d failed)" % (len(samples), failures))
+    print("Elapsed:            %.2fs" % elapsed)
+    print("Throughput:         %.2f requests/s, %.0f videos/s" % (
+        len(samples) / elapsed, len(samples) * videos / elapsed))
+    print("Latency:            p50 %.1fms  p95 %.1fms  p99 %.1fms  max %.1fms" % tuple(
+        percentile(samples, p) * 1000 for p in (50, 95, 99, 100)))
+    print("Server API calls:   %s" % ", ".join(
+        "%s=%d" % item for item in sorted(server.api.calls.items())))
+    print()
+    print(format_report(manager.metrics_snapshot()))
+
+
+if __name__ == "__main__":
+    main()
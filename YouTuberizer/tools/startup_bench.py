@@ -0,0 +1,133 @@
+"""
+Measure how long it takes for the YouTuberizer plugin to load, outside of
+Sublime Text, using the stub sublime module in the stubs folder.
+
+Each measurement is taken in a fresh interpreter so that nothing is cached in
+sys.modules between runs; the median of all runs is reported. The cost of the
+credential key derivation and of importing the Google API client stack are
+reported separately, since both of those used to be paid at load time and are
+now deferred until the network thread first needs them.
+
+Usage: python startup_bench.py [runs]
+"""
+import os
+import sys
+import json
+import time
+import hashlib
+import statistics
+import subprocess
+
+
+###----------------------------------------------------------------------------
+
+
+_tools = os.path.dirname(os.path.abspath(__file__))
+_root = os.path.dirname(os.path.dirname(_tools))
+
+# The script that is executed in a child interpreter to time the plugin load;
+# this is the import of the plugin plus the call to plugin_loaded().
+_load_script = """
+import sys, time, json
+sys.path[:0] = [{stubs!r}, {root!r}]
+start = time.perf_counter()
+from YouTuberizer import youtuberizer
+youtuberizer.plugin_loaded()
+loaded = time.perf_counter()
+youtuberizer.plugin_unloaded()
+google = sorted(m for m in sys.modules if m.split(".")[0] in {google!r})
+print(json.dumps({{"load": loaded - start, "google": google}}))
+"""
+
+# The script that is executed in a child interpreter to time the import of the
+# Google API client stack that the network thread uses.
+_google_script = """
+import time
+start = time.perf_counter()
+import google.oauth2.credentials
+import google_auth_oauthlib.flow
+import googleapiclient.discovery
+print(time.perf_counter() - start)
+"""
+
+# The top level packages that make up the Google API client stack.
+_google_packages = ["google", "google_auth_oauthlib", "googleapiclient",
+                    "google_auth_httplib2", "httplib2", "oauthlib"]
+
+
+###----------------------------------------------------------------------------
+
+
+def time_plugin_load():
+    """
+    Load the plugin in a child interpreter and return the time it took, along
+    with the list of Google API client modules that got imported as a result.
+    """
+    script = _load_script.format(stubs=os.path.join(_tools, "stubs"), root=_root,
+                                 google=_google_packages)
+    output = subprocess.check_output([sys.executable, "-c", script])
+    result = json.loads(output.decode("utf-8").splitlines()[-1])
+    return result["load"], result["google"]
+
+
+def time_google_import():
+    """
+    Import the Google API client stack in a child interpreter and return the
+    time it took, or None if it's not installed.
+    """
+    try:
+        output = subprocess.check_output([sys.executable, "-c", _google_script],
+                                         stderr=subprocess.DEVNULL)
+    except subprocess.CalledProcessError:
+        return None
+
+    return float(output.decode("utf-8").splitlines()[-1])
+
+
+def time_key_derivation():
+    """
+    Return a dictionary that contains the time taken to derive the credential
+    key using each of the available scrypt implementations.
+    """
+    password, salt = "password".encode(), "YouTuberizerSaltValue".encode()
+    results = {}
+
+    if hasattr(hashlib, "scrypt"):
+        start = time.perf_counter()
+        hashlib.scrypt(password, salt=salt, n=1024, r=1, p=1, dklen=32)
+        results["hashlib"] = time.perf_counter() - start
+
+    try:
+        from pyscrypt import hash as scrypt
+        start = time.perf_counter()
+        scrypt(password, salt, 1024, 1, 1, 32)
+        results["pyscrypt"] = time.perf_counter() - start
+    except ImportError:
+        pass
+
+    return results
+
+
+def main(runs):
+    loads = [time_plugin_load() for _ in range(runs)]
+    load = statistics.median(elapsed for elapsed, _ in loads)
+    keys = time_key_derivation()
+
+    google_times = [time_google_import() for _ in range(runs)]
+    google = None if None in google_times else statistics.median(google_times)
+
+    print("Plugin load (median of %d runs): %7.1f ms" % (runs, load * 1000))
+    print("Google modules imported at load: %d" % len(loads[0][1]))
+    for name, elapsed in sorted(keys.items()):
+        print("Key derivation with %-9s      %7.1f ms" % (name + ":", elapsed * 1000))
+
+    if google is not None:
+        print("Google API client import:        %7.1f ms" % (google * 1000))
+
+    if "pyscrypt" in keys and google is not None:
+        print("Load with eager imports and key: %7.1f ms" % (
+            (load + google + keys["pyscrypt"]) * 1000))
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 5)
@@ -0,0 +1,128 @@
+"""
+A minimal stand in for the sublime module, so that the network layer of the
+package can be loaded and driven outside of Sublime Text by the scripts in the
+tools folder.
+
+Callbacks scheduled with set_timeout() are queued up and only run when pump()
+is called, which emulates them being run in the main thread.
+"""
+import os
+import tempfile
+import threading
+
+
+###----------------------------------------------------------------------------
+
+
+DIALOG_YES = 1
+DIALOG_NO = 2
+DIALOG_CANCEL = 0
+
+_pending = []
+_pending_lock = threading.Lock()
+_root = tempfile.mkdtemp(prefix="youtuberizer_")
+
+os.makedirs(os.path.join(_root, "Packages"))
+os.makedirs(os.path.join(_root, "Cache"))
+
+
+###----------------------------------------------------------------------------
+
+
+def set_timeout(callback, delay=0):
+    with _pending_lock:
+        _pending.append(callback)
+
+
+def set_timeout_async(callback, delay=0):
+    timer = threading.Timer(delay / 1000.0, callback)
+    timer.daemon = True
+    timer.start()
+
+
+def pump():
+    """
+    Run all of the callbacks that have been scheduled with set_timeout(),
+    including any that get scheduled while doing so. Returns the number of
+    callbacks that were run.
+    """
+    executed = 0
+    while True:
+        with _pending_lock:
+            if not _pending:
+                return executed
+            callback = _pending.pop(0)
+
+        callback()
+        executed += 1
+
+
+def packages_path():
+    return os.path.join(_root, "Packages")
+
+
+def cache_path():
+    return os.path.join(_root, "Cache")
+
+
+def error_message(msg):
+    print("error_message: %s" % msg)
+
+
+def message_dialog(msg):
+    print("message_dialog: %s" % msg)
+
+
+def status_message(msg):
+    print("status_message: %s" % msg)
+
+
+def active_window():
+    return None
+
+
+###----------------------------------------------------------------------------
+
+
+class Settings(dict):
+    def get(self, key, default=None):
+        return super().get(key, default)
+
+    def set(self, key, value):
+        self[key] = value
+
+    def has(self, key):
+        return key in self
+
+    def erase(self, key):
+        self.pop(key, None)
+
+    def add_on_change(self, tag, callback):
+        pass
+
+    def clear_on_change(self, tag):
+        pass
+
+
+def load_settings(name):
+    return Settings()
+
+
+class Region():
+    def __init__(self, a, b=None):
+        self.a = a
+        self.b = a if b is None else b
+
+    def begin(self):
+        return min(self.a, self.b)
+
+    def end(self):
+        return max(self.a, self.b)
+
+
+class Window():
+    pass
+
+
+class View():
+    pass
@@ -0,0 +1,23 @@
+"""
+A minimal stand in for the sublime_plugin module; see sublime.py.
+"""
+
+
+class ApplicationCommand():
+    pass
+
+
+class WindowCommand():
+    pass
+
+
+class TextCommand():
+    pass
+
+
+class EventListener():
+    pass
+
+
+class ViewEventListener():
+    pass
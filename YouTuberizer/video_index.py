@@ -0,0 +1,238 @@
+import re
+from threading import Lock
+
+# Not every build of Python that Sublime ships with includes sqlite3, so the
+# index is only available when it does.
+try:
+    import sqlite3
+except ImportError:
+    sqlite3 = None
+
+
+###----------------------------------------------------------------------------
+
+
+# The version of the index schema; an index with a different version is thrown
+# away and rebuilt.
+_SCHEMA_VERSION = 1
+
+# The full text search modules to try using for the index, in order of
+# preference; when none are available, searches fall back to LIKE.
+_FTS_MODULES = ["fts5", "fts4"]
+
+# How many videos are written to the index at a time; the lock is released
+# between batches so that searches in the main thread don't have to wait for
+# a whole playlist to be indexed.
+_WRITE_BATCH = 100
+
+
+###----------------------------------------------------------------------------
+
+
+class VideoIndex():
+    """
+    A local SQLite index of the titles, descriptions and tags of the videos in
+    a channel, so that they can be searched without talking to YouTube.
+
+    The index is written to by the network thread as results arrive and read
+    from in the main thread, so all access is serialized with a lock. Large
+    writes are broken into batches so that the lock is never held for long.
+    The database is not opened until the first time it's needed.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.lock = Lock()
+        self.db = None
+        self.fts = None
+
+    @staticmethod
+    def available():
+        """
+        Returns an indication of whether an index can be created at all.
+        """
+        return sqlite3 is not None
+
+    def open(self):
+        """
+        Open the database and create the tables if needed; the caller must be
+        holding the lock.
+        """
+        if self.db is not None:
+            return self.db
+
+        self.db = sqlite3.connect(self.path, check_same_thread=False)
+        version = self.db.execute("PRAGMA user_version").fetchone()[0]
+        if version != _SCHEMA_VERSION:
+            self.db.executescript("""
+                DROP TABLE IF EXISTS videos;
+                DROP TABLE IF EXISTS video_text;
+                """)
+
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS videos (
+                video_id TEXT PRIMARY KEY,
+                title TEXT NOT NULL,
+                description TEXT NOT NULL DEFAULT '',
+                tags TEXT,
+                published TEXT
+            )""")
+
+        for module in _FTS_MODULES:
+            try:
+                self.db.execute("""
+                    CREATE VIRTUAL TABLE IF NOT EXISTS video_text
+                        USING %s(title, description, tags)""" % module)
+                self.fts = module
+                break
+            except sqlite3.OperationalError:
+                pass
+
+        self.db.execute("PRAGMA user_version = %d" % _SCHEMA_VERSION)
+        self.db.commit()
+
+        return self.db
+
+    def close(self):
+        with self.lock:
+            if self.db is not None:
+                self.db.close()
+                self.db = None
+
+    def clear(self):
+        """
+        Remove all videos from the index.
+        """
+        with self.lock:
+            db = self.open()
+            db.execute("DELETE FROM videos")
+            if self.fts:
+                db.execute("DELETE FROM video_text")
+            db.commit()
+
+    def update(self, videos):
+        """
+        Add or update videos in the index. Each video is a dictionary with a
+        video_id key and any of title, description, tags (a list) and
+        published; keys that are not present leave the indexed value alone.
+
+        Videos are written and committed in batches of _WRITE_BATCH.
+        """
+        videos = list(videos)
+        for start in range(0, len(videos), _WRITE_BATCH):
+            with self.lock:
+                db = self.open()
+                for video in videos[start:start + _WRITE_BATCH]:
+                    row = db.execute("""
+                        SELECT rowid, title, description, tags, published
+                        FROM videos WHERE video_id = ?""", (video["video_id"],)).fetchone()
+
+                    rowid, title, description, tags, published = row or (None, "", "", None, None)
+                    title = video.get("title", title)
+                    description = video.get("description", description) or ""
+                    published = video.get("published", published)
+                    if "tags" in video:
+                        tags = " ".join(video["tags"] or [])
+
+                    if rowid is None:
+                        rowid = db.execute("""
+                            INSERT INTO videos (video_id, title, description, tags, published)
+                            VALUES (?, ?, ?, ?, ?)""",
+                            (video["video_id"], title, description, tags, published)).lastrowid
+                    else:
+                        db.execute("""
+                            UPDATE videos SET title = ?, description = ?, tags = ?, published = ?
+                            WHERE rowid = ?""", (title, description, tags, published, rowid))
+
+                    if self.fts:
+                        db.execute("DELETE FROM video_text WHERE rowid = ?", (rowid,))
+                        db.execute("""
+                            INSERT INTO video_text (rowid, title, description, tags)
+                            VALUES (?, ?, ?, ?)""", (rowid, title, description, tags or ""))
+
+                db.commit()
+
+    def prune(self, video_ids):
+        """
+        Remove every video from the index that is not in the given list of
+        video ID's.
+        """
+        with self.lock:
+            keep = set(video_ids)
+            gone = [(rowid,) for rowid, video_id in self.open().execute(
+                "SELECT rowid, video_id FROM videos") if video_id not in keep]
+
+        for start in range(0, len(gone), _WRITE_BATCH):
+            with self.lock:
+                db = self.open()
+                batch = gone[start:start + _WRITE_BATCH]
+                db.executemany("DELETE FROM videos WHERE rowid = ?", batch)
+                if self.fts:
+                    db.executemany("DELETE FROM video_text WHERE rowid = ?", batch)
+                db.commit()
+
+    def mark_unavailable(self, video_ids):
+        """
+        Record that the details of the given videos could not be fetched
+        because they are deleted or private, so that needs_details() does not
+        keep returning them; they are given an empty list of tags.
+        """
+        with self.lock:
+            db = self.open()
+            db.executemany("UPDATE videos SET tags = '' WHERE video_id = ? AND tags IS NULL",
+                           [(video_id,) for video_id in video_ids])
+            db.commit()
+
+    def count(self):
+        """
+        Return the number of videos in the index.
+        """
+        with self.lock:
+            return self.open().execute("SELECT COUNT(*) FROM videos").fetchone()[0]
+
+    def needs_details(self, limit=1000):
+        """
+        Return the ID's of up to limit videos in the index that we don't have
+        the tags for yet, newest first.
+        """
+        with self.lock:
+            return [r[0] for r in self.open().execute("""
+                SELECT video_id FROM videos WHERE tags IS NULL
+                ORDER BY published DESC LIMIT ?""", (limit,))]
+
+    def search(self, query, limit=200):
+        """
+        Search the index for videos that contain all of the words in the query
+        (as a prefix) in their title, description or tags. The result is a
+        list of [title, url] items, best matches first where the index can
+        rank them and newest first otherwise.
+        """
+        words = re.findall(r"\w+", query)
+        if not words:
+            return []
+
+        with self.lock:
+            db = self.open()
+            if self.fts:
+                # fts5 takes the prefix marker outside of the quoted string
+                # and fts4 inside of it.
+                term = '"%s"*' if self.fts == "fts5" else '"%s*"'
+                match = " ".join(term % w for w in words)
+                order = "video_text.rank" if self.fts == "fts5" else "videos.published DESC"
+                rows = db.execute("""
+                    SELECT videos.title, videos.video_id
+                    FROM video_text JOIN videos ON videos.rowid = video_text.rowid
+                    WHERE video_text MATCH ?
+                    ORDER BY %s LIMIT ?""" % order, (match, limit))
+            else:
+                where = " AND ".join(
+                    "(title || ' ' || description || ' ' || IFNULL(tags, '')) LIKE ?"
+                    for w in words)
+                rows = db.execute("""
+                    SELECT title, video_id FROM videos WHERE %s
+                    ORDER BY published DESC LIMIT ?""" % where,
+                    ["%%%s%%" % w for w in words] + [limit])
+
+            return [[title, 'https://youtu.be/%s' % video_id] for title, video_id in rows]
+
+
+###----------------------------------------------------------------------------
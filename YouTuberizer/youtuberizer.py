@@ -2,9 +2,14 @@ import sublime
 import sublime_plugin
 
 import os
+import json
 
 
 from .networking import NetworkManager, Request, stored_credentials_path, log
+from .networking import set_log_level
+from .networking import PRIORITY_INTERACTIVE, PRIORITY_BACKGROUND
+from .metrics import format_report
+from .thumbnails import thumbnail_html
 
 
 ###----------------------------------------------------------------------------
@@ -13,6 +18,10 @@ from .networking import NetworkManager, Request, stored_credentials_path, log
 # Our global network manager object
 netManager = None
 
+# When showing a list of videos, the thumbnails of this many videos on either
+# side of the selected one are fetched ahead of time.
+THUMBNAIL_PREFETCH = 5
+
 
 ###----------------------------------------------------------------------------
 
@@ -23,7 +32,24 @@ def plugin_loaded():
     """
     global netManager
 
-    netManager = NetworkManager()
+    yt_setting.obj = sublime.load_settings("YouTuberizer.sublime-settings")
+    yt_setting.default = {
+        "network_engine": "thread",
+        "network_workers": 4,
+        "request_timeout": 120,
+        "warm_up": False,
+        "show_thumbnails": True,
+        "log_level": "info",
+    }
+
+    set_log_level(yt_setting("log_level"))
+
+    netManager = NetworkManager(engine=yt_setting("network_engine"),
+                                workers=yt_setting("network_workers"),
+                                timeout=yt_setting("request_timeout"))
+
+    if yt_setting("warm_up") and netManager.has_credentials():
+        YoutubeWarmUp().start()
 
 
 def plugin_unloaded():
@@ -37,6 +63,64 @@ def plugin_unloaded():
 ###----------------------------------------------------------------------------
 
 
+def yt_setting(key):
+    """
+    Get a package setting from the cached settings object with a sensible
+    default.
+    """
+    default = yt_setting.default.get(key, None)
+    return yt_setting.obj.get(key, default)
+
+
+###----------------------------------------------------------------------------
+
+
+def show_videos(videos, on_select):
+    """
+    Display a list of [title, url] videos in a quick panel in the active
+    window, invoking on_select with the index of the chosen video (or -1 if
+    the panel was cancelled).
+
+    When enabled, the thumbnail of the selected video is shown in a popup
+    while the panel is open, and the thumbnails of the videos around it are
+    fetched ahead of time so that they're ready when the selection moves.
+    """
+    window = sublime.active_window()
+    view = window.active_view()
+    if not yt_setting("show_thumbnails") or view is None:
+        return window.show_quick_panel(videos, on_select)
+
+    selected = [0]
+
+    def video_id(index):
+        return videos[index][1].rsplit("/", 1)[-1]
+
+    def show_thumbnail(index, encoded):
+        if selected[0] != index or encoded is None:
+            return
+
+        view.show_popup(thumbnail_html(encoded), 0, -1, 340, 200)
+
+    def highlight(index):
+        selected[0] = index
+        nearby = range(max(0, index - THUMBNAIL_PREFETCH),
+                       min(len(videos), index + THUMBNAIL_PREFETCH + 1))
+
+        netManager.thumbnails.fetch([video_id(index)],
+                                    lambda v, e: show_thumbnail(index, e))
+        netManager.thumbnails.fetch([video_id(i) for i in nearby if i != index])
+
+    def select(index):
+        selected[0] = None
+        view.hide_popup()
+        on_select(index)
+
+    window.show_quick_panel(videos, select, 0, 0, highlight)
+
+
+###----------------------------------------------------------------------------
+
+
 class YoutubeRequest():
     """
     This class abstracts away the common portions of using the NetworkManager
@@ -45,23 +129,41 @@ class YoutubeRequest():
     A request can be made via the `request()` method, and the result will
     be automatically directed to a method in the class. The default handler
     is the name of the request preceeded by an underscore.
+
+    Requests are interactive by default; refresh and priority are passed
+    through to the NetworkManager to bypass its cache and to make background
+    requests.
+
+    If the warm up is still logging in when a command runs, the command waits
+    for it instead of making its own authorize request, and only asks the user
+    to log in if that fails.
     """
     auth_req = None
     auth_resp = None
 
     def run(self, **kwargs):
-        if not netManager.is_authorized():
+        if netManager.is_authorized():
+            self._authorized(self.auth_req, self.auth_resp)
+        elif netManager.is_pending(YoutubeWarmUp.auth_request):
+            netManager.request(YoutubeWarmUp.auth_request, self._warm_up_auth)
+        else:
             self.request("authorize", "_internal_auth")
+
+    def _warm_up_auth(self, request, success, result):
+        if success:
+            self._internal_auth(request, result)
         else:
-            self._authorized(self.auth_req, self.auth_resp)
+            self.request("authorize", "_internal_auth")
 
     def _internal_auth(self, request, result):
         self.auth_req = request
         self.auth_resp = result
         self._authorized(self.auth_req, self.auth_resp)
 
-    def request(self, request, handler=None, **kwargs):
-        netManager.request(Request(request, handler, **kwargs), self.result)
+    def request(self, request, handler=None, refresh=False,
+                priority=PRIORITY_INTERACTIVE, **kwargs):
+        return netManager.request(Request(request, handler, **kwargs), self.result,
+                                  refresh=refresh, priority=priority)
 
     def result(self, request, success, result):
         attr = request.handler if success else "_error"
@@ -90,6 +192,45 @@ class YoutubeRequest():
 ###----------------------------------------------------------------------------
 
 
+class YoutubeWarmUp(YoutubeRequest):
+    """
+    Log in and fetch the contents of the uploads playlist in the background,
+    so that the results are already cached by the time the first command that
+    needs them runs; the playlist requests are made exactly as the commands
+    make them, so that a command that runs while they are still pending waits
+    for them instead of making them again.
+
+    This never asks the user to log in, so its authorize request is not the
+    same as the one the commands make; see YoutubeRequest.run() for how they
+    wait for it instead. If the stored credentials are not usable, the warm up
+    quietly does nothing.
+    """
+    # The request used to log in without ever asking the user to.
+    auth_request = Request("authorize", "_internal_auth", interactive=False)
+
+    def start(self):
+        netManager.request(self.auth_request, self.result, priority=PRIORITY_BACKGROUND)
+
+    def _authorized(self, request, result):
+        self.request("uploads_playlist", priority=PRIORITY_BACKGROUND)
+
+    def _uploads_playlist(self, request, result):
+        self.request("playlist_contents", playlist_id=result, incremental=True,
+                     priority=PRIORITY_BACKGROUND)
+
+    def _playlist_contents(self, request, result):
+        log("Warm up complete; {0} videos cached", len(result))
+
+    def _error(self, request, result):
+        log("Warm up skipped; {0} failed: {1}", request.name, result)
+
+    def name(self):
+        return "warm_up"
+
+
+###----------------------------------------------------------------------------
+
+
 class YoutuberizerAuthorizeCommand(YoutubeRequest, sublime_plugin.ApplicationCommand):
     """
     If there are not any cached credentials for the user's YouTube account,
@@ -154,15 +295,111 @@ class YoutuberizerListVideosCommand(YoutubeRequest, sublime_plugin.ApplicationCo
         self.request("uploads_playlist")
 
     def _uploads_playlist(self, request, result):
-        self.request("playlist_contents", playlist_id=result)
+        self.request("playlist_contents", playlist_id=result, incremental=True)
+
+    def _playlist_contents(self, request, result):
+        show_videos(result, lambda i: self.select_video(result, i))
+
+    def select_video(self, results, index):
+        if index >= 0:
+            sublime.set_clipboard(results[index][1])
+            sublime.status_message('URL Copied: %s' % results[index][0])
+
+
+###----------------------------------------------------------------------------
+
+
+class YoutuberizerSearchVideosCommand(YoutubeRequest, sublime_plugin.ApplicationCommand):
+    """
+    Search the videos in the user's YouTube channel by title, description and
+    tags. The search is answered from a local index of the channel, which is
+    brought up to date in the background every time a search is made.
+    """
+    def run(self, query=None):
+        if query is None:
+            return sublime.active_window().show_input_panel("Search Videos:", "",
+                lambda q: sublime.run_command("youtuberizer_search_videos", {"query": q}),
+                None, None)
+
+        results = netManager.search_videos(query)
+        if results:
+            show_videos(results, lambda i: self.select_video(results, i))
+        else:
+            sublime.status_message("No videos match '%s'" % query)
+
+        # Bring the index up to date for next time.
+        super().run()
+
+    def _authorized(self, request, result):
+        self.request("uploads_playlist", priority=PRIORITY_BACKGROUND)
+
+    def _uploads_playlist(self, request, result):
+        self.request("playlist_contents", playlist_id=result, incremental=True,
+                     refresh=True, priority=PRIORITY_BACKGROUND)
 
     def _playlist_contents(self, request, result):
-        window = sublime.active_window()
-        window.show_quick_panel(result, lambda i: self.select_video(result[i]))
+        video_ids = netManager.index.needs_details()
+        if video_ids:
+            self.request("video_details", video_ids=video_ids,
+                         priority=PRIORITY_BACKGROUND)
+
+    def _video_details(self, request, result):
+        pass
+
+    def select_video(self, results, index):
+        if index >= 0:
+            sublime.set_clipboard(results[index][1])
+            sublime.status_message('URL Copied: %s' % results[index][0])
+
+    def is_enabled(self, query=None):
+        return netManager.has_credentials() and netManager.index is not None
+
+
+###----------------------------------------------------------------------------
+
+
+class YoutuberizerTrimLogCommand(sublime_plugin.TextCommand):
+    """
+    Trim the YouTuberizer output panel down to at most the given number of
+    characters, removing whole lines from the start. This is used internally
+    to keep the panel from growing without bound.
+    """
+    def run(self, edit, size):
+        excess = self.view.size() - size
+        if excess <= 0:
+            return
+
+        cut = self.view.full_line(excess).end()
+        self.view.set_read_only(False)
+        self.view.erase(edit, sublime.Region(0, cut))
+        self.view.set_read_only(True)
+
+
+###----------------------------------------------------------------------------
+
+
+class YoutuberizerNetworkMetricsCommand(sublime_plugin.ApplicationCommand):
+    """
+    Display a report of the metrics that have been gathered about the network
+    layer in the YouTuberizer output panel, or export them as JSON into a new
+    view. The metrics can optionally be reset afterwards.
+    """
+    def run(self, export=False, reset=False):
+        snapshot = netManager.metrics_snapshot()
+
+        if export:
+            window = sublime.active_window()
+            view = window.new_file()
+            view.set_name("YouTuberizer Metrics.json")
+            view.set_scratch(True)
+            view.assign_syntax("Packages/JavaScript/JSON.sublime-syntax")
+            view.run_command("append", {
+                "characters": json.dumps(snapshot, indent=4, sort_keys=True)})
+        else:
+            log("{0}", format_report(snapshot), panel=True)
 
-    def select_video(self, video):
-        sublime.set_clipboard(video[1])
-        sublime.status_message('URL Copied: %s' % video[0])
+        if reset:
+            netManager.metrics.reset()
 
 
 ###----------------------------------------------------------------------------